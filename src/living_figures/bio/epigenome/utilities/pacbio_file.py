@@ -7,6 +7,7 @@ from widgets.base.helpers import parse_dataframe_string
 from widgets.base.helpers import encode_dataframe_string
 import pandas as pd
 from widgets.streamlit.resource.files.base import StFile
+from living_figures.helpers.tracing import traced
 
 
 class StPBMotif(StFile):
@@ -112,6 +113,7 @@ class StPBMotif(StFile):
                     # Read the CSV
                     self.parse_csv(file)
 
+    @traced(cat="parse")
     def parse_csv(self, file):
 
         # Read the CSV file
@@ -9,6 +9,7 @@ import widgets.streamlit as wist
 from living_figures.bio.epigenome.utilities.pacbio_file import StPBMotif
 from living_figures.helpers.scaling import convert_text_to_scalar
 from living_figures.helpers.sorting import sort_table
+from living_figures.helpers.caching import cache_data
 import streamlit as st
 
 st.set_page_config(layout="wide")
@@ -32,6 +33,8 @@ class PanEpiGenomeBrowser(wist.StreamlitWidget):
         "from living_figures.bio.epigenome.utilities.pacbio_file import StPBMotif", # noqa
         "from living_figures.helpers.scaling import convert_text_to_scalar",
         "from living_figures.helpers.sorting import sort_table",
+        "from living_figures.helpers.caching import cache_data",
+        "from living_figures.helpers.tracing import traced",
         "from widgets.base.helpers import encode_dataframe_string",
         "from widgets.base.helpers import parse_dataframe_string"
     ]
@@ -728,17 +731,7 @@ class PanEpiGenomeBrowser(wist.StreamlitWidget):
             return None, None
 
         # MAKE A WIDE TABLE
-        value_df = user_inputs["pacbio"].pivot_table(
-            index="genome",
-            columns="motif_id",
-            values="fraction"
-        ).fillna(0)
-
-        text_df = user_inputs["pacbio"].pivot(
-            index="genome",
-            columns="motif_id",
-            values="text"
-        ).fillna("")
+        value_df, text_df = self.pivot_motifs(user_inputs["pacbio"])
 
         # MASK ANY SELECTED ROWS/COLUMNS
         if len(user_inputs['hidden_motifs']) > 0:
@@ -787,7 +780,7 @@ class PanEpiGenomeBrowser(wist.StreamlitWidget):
             return None, None
 
         # SORT THE ROWS/COLUMNS
-        value_df = sort_table(value_df)
+        value_df = self.cluster_heatmap(value_df)
 
         # REALIGN TEXT TABLE TO MATCH VALUES
         text_df = text_df.reindex(
@@ -797,6 +790,33 @@ class PanEpiGenomeBrowser(wist.StreamlitWidget):
 
         return value_df, text_df
 
+    @cache_data(max_entries=10)
+    def pivot_motifs(
+        _self,
+        pacbio: pd.DataFrame
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Make wide tables of the motif values and hovertext."""
+
+        value_df = pacbio.pivot_table(
+            index="genome",
+            columns="motif_id",
+            values="fraction"
+        ).fillna(0)
+
+        text_df = pacbio.pivot(
+            index="genome",
+            columns="motif_id",
+            values="text"
+        ).fillna("")
+
+        return value_df, text_df
+
+    @cache_data(max_entries=10)
+    def cluster_heatmap(_self, value_df: pd.DataFrame) -> pd.DataFrame:
+        """Sort the rows and columns of the heatmap by linkage clustering."""
+
+        return sort_table(value_df)
+
 
 if __name__ == "__main__":
     w = PanEpiGenomeBrowser()
@@ -1,2 +1,5 @@
 from living_figures.bio.fom.utilities.parse_tax_string import parse_tax_string # noqa
-from living_figures.bio.fom.utilities.parse_taxon_abundances import parse_taxon_abundances # noqa
\ No newline at end of file
+from living_figures.bio.fom.utilities.parse_taxon_abundances import parse_taxon_abundances # noqa
+from living_figures.bio.fom.utilities.nmds import nmds # noqa
+from living_figures.bio.fom.utilities.streaming_pca import streaming_pca # noqa
+from living_figures.bio.fom.utilities.compositional import log_proportions, clr, alr, alr_reference # noqa
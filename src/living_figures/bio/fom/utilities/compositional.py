@@ -0,0 +1,98 @@
+from typing import Union
+import numpy as np
+import pandas as pd
+
+
+def log_proportions(abund: pd.DataFrame, delta: float = 0.65) -> pd.DataFrame:
+    """
+    Log of the proportion of each organism (row) in each sample (column),
+    after replacing zeros with the multiplicative method (Martín-Fernández
+    et al., 2003). Each zero is replaced with delta times the smallest
+    proportion detected in that sample, and the detected proportions are
+    scaled down so that every sample still sums to 1.
+
+    The log is only taken of the detected values, so tables with sparse
+    columns are not converted to dense arrays before the result is filled.
+    """
+
+    is_sparse = abund.shape[0] > 0 and all(
+        isinstance(dtype, pd.SparseDtype) for dtype in abund.dtypes
+    )
+
+    if is_sparse:
+        coo = abund.sparse.to_coo()
+        rows, cols = coo.row, coo.col
+        values = coo.data.astype(np.float64)
+        keep = values > 0
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+    else:
+        mat = abund.values.astype(np.float64)
+        rows, cols = np.nonzero(mat > 0)
+        values = mat[rows, cols]
+
+    n_orgs, n_samples = abund.shape
+
+    # Proportion of each detected value within its sample
+    totals = np.bincount(cols, weights=values, minlength=n_samples)
+    props = values / totals[cols]
+
+    # Smallest detected proportion and number of zeros in each sample
+    min_props = np.full(n_samples, np.inf)
+    np.minimum.at(min_props, cols, props)
+    n_zeros = n_orgs - np.bincount(cols, minlength=n_samples)
+
+    # Replacement value of each sample, and the scaling of detected values
+    replacement = delta * min_props
+    scale = 1 - n_zeros * replacement
+
+    # Every value starts as the replacement for its sample
+    log_props = np.broadcast_to(
+        np.log(np.where(n_zeros > 0, replacement, 1.)),
+        (n_orgs, n_samples)
+    ).copy()
+    log_props[rows, cols] = np.log(props * scale[cols])
+
+    return pd.DataFrame(
+        log_props,
+        index=abund.index,
+        columns=abund.columns
+    )
+
+
+def clr(log_props: pd.DataFrame) -> pd.DataFrame:
+    """
+    Centered log-ratio transform of the log proportions of each
+    organism (row) in each sample (column).
+    """
+
+    return log_props - log_props.mean()
+
+
+def alr(
+    log_props: pd.DataFrame,
+    reference: Union[str, None] = None
+) -> pd.DataFrame:
+    """
+    Additive log-ratio transform of the log proportions of each organism
+    (row) in each sample (column), relative to a reference organism
+    which is removed from the table. By default, the reference is the
+    last organism (see alr_reference).
+    """
+
+    if reference is None:
+        reference = log_props.index.values[-1]
+
+    return (
+        log_props - log_props.loc[reference]
+    ).drop(index=reference)
+
+
+def alr_reference(abund: pd.DataFrame) -> str:
+    """
+    Choose the organism detected in the most samples (and the most abundant
+    of those) as the reference for the additive log-ratio transform.
+    """
+
+    detected = (abund > 0).sum(axis=1)
+    candidates = detected.index[detected == detected.max()]
+    return abund.loc[candidates].mean(axis=1).idxmax()
@@ -0,0 +1,57 @@
+from living_figures.helpers.concurrency import process_map
+from sklearn.manifold import smacof
+from typing import Tuple
+import numpy as np
+
+
+def nmds(
+    dm: np.ndarray,
+    n_components: int = 2,
+    n_starts: int = 4,
+    max_iter: int = 300,
+    tol: float = 1e-4,
+    random_state: int = 0
+) -> Tuple[np.ndarray, float]:
+    """
+    Non-metric multidimensional scaling of a square distance matrix.
+    Each of n_starts random starting configurations is run in a pool of
+    processes, and the solution with the lowest (normalized) stress is kept.
+    Each start stops early once the stress improves by less than tol.
+    Returns the coordinates of each sample and the stress.
+    """
+
+    dm = np.asarray(dm, dtype=np.float64)
+
+    # Every start uses a different (reproducible) seed
+    seeds = np.random.default_rng(random_state).integers(
+        2**31,
+        size=n_starts
+    )
+
+    results = process_map(
+        _nmds_start,
+        [
+            (dm, n_components, max_iter, tol, int(seed))
+            for seed in seeds
+        ],
+        max_workers=n_starts
+    )
+
+    return min(results, key=lambda result: result[1])
+
+
+def _nmds_start(args) -> Tuple[np.ndarray, float]:
+    """Run NMDS from a single random starting configuration."""
+
+    dm, n_components, max_iter, tol, seed = args
+
+    return smacof(
+        dm,
+        metric=False,
+        n_components=n_components,
+        n_init=1,
+        max_iter=max_iter,
+        eps=tol,
+        random_state=seed,
+        normalized_stress=True
+    )
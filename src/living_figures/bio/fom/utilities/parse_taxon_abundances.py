@@ -1,8 +1,10 @@
 from living_figures.bio.fom.utilities import parse_tax_string
+from living_figures.helpers.tracing import traced
 from typing import Tuple
 import pandas as pd
 
 
+@traced(cat="parse")
 def parse_taxon_abundances(
     df: pd.DataFrame
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -0,0 +1,188 @@
+from typing import Iterator, Tuple, Union
+import warnings
+import numpy as np
+import pandas as pd
+
+
+def iter_sample_batches(
+    data: Union[pd.DataFrame, np.ndarray],
+    batch_size: int
+) -> Iterator[np.ndarray]:
+    """
+    Yield batches of samples (as a samples x features array) from either
+    a table of abundances with a column per sample, or an array (which may
+    be a np.memmap read from disk) with a row per sample.
+    Only a single batch is copied into memory at a time.
+    """
+
+    is_table = isinstance(data, pd.DataFrame)
+    n_samples = data.shape[1] if is_table else data.shape[0]
+
+    for start in range(0, n_samples, batch_size):
+
+        if is_table:
+            batch = data.iloc[:, start:start + batch_size]
+            if any(
+                isinstance(dtype, pd.SparseDtype) for dtype in batch.dtypes
+            ):
+                batch = batch.sparse.to_dense()
+            batch = batch.values.T
+        else:
+            batch = data[start:start + batch_size]
+
+        yield np.asarray(batch, dtype=np.float64)
+
+
+def streaming_pca(
+    data: Union[pd.DataFrame, np.ndarray],
+    n_components: int = 3,
+    batch_size: int = 10000,
+    max_features: int = 4096,
+    max_iter: int = 500,
+    tol: float = 1e-9,
+    random_state: int = 0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Principal Components Analysis which reads the samples in batches,
+    giving the same results as a PCA fit with every sample in memory.
+
+    The mean and variance of each feature are accumulated in a first pass
+    over the batches. With up to max_features features (4096 by default,
+    a 128 MB covariance matrix), the covariance is accumulated in the same
+    pass and decomposed exactly. With more features, the leading components
+    are found by subspace iteration, which reads every batch once for each
+    iteration (up to max_iter), until the residual of each component is
+    below tol. In that case the memory used is bounded by the size of
+    each batch and of the components, rather than features x features.
+    The samples are projected onto the components in a final pass.
+
+    Returns the coordinates of each sample, the components (with the
+    same signs as sklearn.decomposition.PCA), and the fraction of the
+    variance explained by each component.
+    """
+
+    n_samples = 0
+    mean = None
+    sq_devs = None
+    scatter = None
+
+    # Combine the mean and squared deviations of each batch with those
+    # of all of the previous batches (Chan et al.)
+    for batch in iter_sample_batches(data, batch_size):
+
+        n_batch = batch.shape[0]
+        batch_mean = batch.mean(axis=0)
+        centered = batch - batch_mean
+
+        if mean is None:
+            exact = batch.shape[1] <= max_features
+            mean = batch_mean
+            sq_devs = (centered ** 2).sum(axis=0)
+            if exact:
+                scatter = centered.T @ centered
+        else:
+            delta = batch_mean - mean
+            n_total = n_samples + n_batch
+            weight = n_samples * n_batch / n_total
+            mean = mean + delta * n_batch / n_total
+            sq_devs += (centered ** 2).sum(axis=0) + delta ** 2 * weight
+            if exact:
+                scatter += centered.T @ centered
+                scatter += np.outer(delta, delta) * weight
+
+        n_samples += n_batch
+
+    if n_samples < 2:
+        raise ValueError("At least two samples are needed for PCA")
+
+    n_components = min(n_components, n_samples, mean.shape[0])
+    total_variance = max(sq_devs.sum() / (n_samples - 1), np.finfo(float).tiny)
+
+    if exact:
+        eigvals, eigvecs = np.linalg.eigh(scatter / (n_samples - 1))
+    else:
+        eigvals, eigvecs = _subspace_iteration(
+            data,
+            mean,
+            n_samples,
+            n_components,
+            batch_size,
+            max_iter,
+            tol,
+            random_state
+        )
+
+    # Keep the largest eigenvalues, in descending order
+    order = np.argsort(eigvals)[::-1][:n_components]
+    explained_variance_ratio = eigvals[order].clip(min=0) / total_variance
+    components = eigvecs[:, order].T
+
+    # The largest loading of each component is positive
+    signs = np.sign(
+        components[np.arange(n_components), np.abs(components).argmax(axis=1)]
+    )
+    components *= np.where(signs == 0, 1, signs)[:, None]
+
+    # Project each batch of samples onto the components
+    coords = np.empty((n_samples, n_components))
+    start = 0
+    for batch in iter_sample_batches(data, batch_size):
+        coords[start:start + batch.shape[0]] = (batch - mean) @ components.T
+        start += batch.shape[0]
+
+    return coords, components, explained_variance_ratio
+
+
+def _subspace_iteration(
+    data: Union[pd.DataFrame, np.ndarray],
+    mean: np.ndarray,
+    n_samples: int,
+    n_components: int,
+    batch_size: int,
+    max_iter: int,
+    tol: float,
+    random_state: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the leading eigenvalues and eigenvectors of the covariance matrix
+    without forming it, by repeatedly multiplying a basis of (oversampled)
+    vectors by the covariance one batch of samples at a time.
+    """
+
+    n_features = mean.shape[0]
+    n_vectors = min(n_components + 10, n_features, n_samples)
+
+    rng = np.random.default_rng(random_state)
+    basis = np.linalg.qr(rng.standard_normal((n_features, n_vectors)))[0]
+
+    for _ in range(max_iter):
+
+        # Product of the covariance and the basis
+        product = np.zeros((n_features, n_vectors))
+        for batch in iter_sample_batches(data, batch_size):
+            centered = batch - mean
+            product += centered.T @ (centered @ basis)
+        product /= n_samples - 1
+
+        # Best estimates of the eigenvectors within the basis
+        eigvals, rotation = np.linalg.eigh(basis.T @ product)
+        eigvecs = basis @ rotation
+
+        # Stop once the leading eigenvectors have converged
+        top = np.argsort(eigvals)[::-1][:n_components]
+        residuals = np.linalg.norm(
+            product @ rotation[:, top] - eigvecs[:, top] * eigvals[top],
+            axis=0
+        ) / max(eigvals[top].max(), np.finfo(float).tiny)
+        if residuals.max() < tol:
+            break
+
+        basis = np.linalg.qr(product)[0]
+
+    else:
+        warnings.warn(
+            f"PCA did not converge after {max_iter:,} passes over the samples"
+            f" (residual {residuals.max():.2g})"
+        )
+
+    return eigvals, eigvecs
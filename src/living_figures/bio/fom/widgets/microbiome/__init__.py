@@ -8,4 +8,5 @@ from living_figures.bio.fom.widgets.microbiome.differential_abundance import Dif
 from living_figures.bio.fom.widgets.microbiome.base_widget import BaseMicrobiomeExplorer # noqa
 from living_figures.bio.fom.widgets.microbiome.single_organism import SingleOrganism # noqa
 from living_figures.bio.fom.widgets.microbiome.compare_two_organisms import CompareTwoOrganisms # noqa
+from living_figures.bio.fom.widgets.microbiome.taxonomy_tree import TaxonomyTree # noqa
 from living_figures.bio.fom.widgets.microbiome.main import MicrobiomeExplorer # noqa
@@ -3,11 +3,13 @@ from living_figures.helpers.constants import tax_levels
 from living_figures.helpers.scaling import convert_text_to_scalar
 from living_figures.helpers.sorting import sort_table
 import widgets.streamlit as wist
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import streamlit as st
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
 
 
 class AbundantOrgs(MicrobiomePlot):
@@ -123,7 +125,8 @@ class AbundantOrgs(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_abundance_data(
         _self,
         tax_level: str,
@@ -163,7 +166,8 @@ class AbundantOrgs(MicrobiomePlot):
 
         return abund
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_plotting_data(
         _self,
         tax_level,
@@ -235,7 +239,8 @@ class AbundantOrgs(MicrobiomePlot):
 
         return abund_df, annot_df
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def make_fig(
         _self,
         tax_level,
@@ -321,7 +326,7 @@ class AbundantOrgs(MicrobiomePlot):
 
         return fig
 
-    def run_self(self):
+    def compute(self) -> dict:
 
         # Get the plotting options
         params = self.all_values(flatten=True)
@@ -342,22 +347,26 @@ class AbundantOrgs(MicrobiomePlot):
             params["heatmap_cpal"]
         )
 
+        return dict(fig=fig, legend=params['legend'])
+
+    def render(self, outputs: dict) -> None:
+
         # If there is a figure
-        if fig is not None:
+        if outputs['fig'] is not None:
 
             # Display it in the 'plot' child resource
             plot_area = self._get_child("plot")
             plot_area.main_empty.plotly_chart(
-                fig,
+                outputs['fig'],
                 use_container_width=True
             )
 
         # If there is a legend
-        if params['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                params['legend']
+                outputs['legend']
             )
 
     def plot_abund(self, plot_type, abund_df, heatmap_cpal):
@@ -369,22 +378,20 @@ class AbundantOrgs(MicrobiomePlot):
 
     def plot_heatmap(self, abund_df: pd.DataFrame, colorscale: str):
 
-        # Mouseover text
-        text_df = abund_df.apply(
-            lambda c: [
-                f"Sample: {c.name}<br>Organism: {n}<br>Abundance: {a:.4g}%"
-                for n, a in c.items()
-            ]
-        )
-
+        # Values are sent to the browser as binary arrays,
+        # and the mouseover text is formatted by the browser
         return [
             go.Heatmap(
                 x=abund_df.columns.values,
                 y=abund_df.index.values,
-                z=abund_df.values,
+                z=abund_df.values.astype(np.float32),
                 colorscale=colorscale,
-                text=text_df.values,
-                hoverinfo="text",
+                hovertemplate=(
+                    "Sample: %{x}<br>"
+                    "Organism: %{y}<br>"
+                    "Abundance: %{z:.4g}%"
+                    "<extra></extra>"
+                ),
                 colorbar_title="Relative<br>Abundance<br>(%)"
             )
         ]
@@ -395,25 +402,17 @@ class AbundantOrgs(MicrobiomePlot):
             go.Bar(
                 name=org_name,
                 x=org_abund.index.values,
-                y=org_abund.values,
-                hovertext=[
-                    f"{sample}<br>{org_name}: {abund:.4g}%"
-                    for sample, abund in org_abund.items()
-                ]
+                y=org_abund.values.astype(np.float32),
+                hovertemplate="%{x}<br>%{fullData.name}: %{y:.4g}%"
             )
             for org_name, org_abund in abund_df.iterrows()
         ]
 
     def plot_annot(self, annot_df, annot_cpal):
 
-        # Capture the annotations as text
-        text_df = annot_df.applymap(
-            lambda i: "" if i is None else str(i)
-        ).apply(
-            lambda c: c.apply(
-                lambda i: f"{c.name}: {i}"
-            )
-        )
+        # Capture the annotations as text, which are labeled
+        # with the name of the annotation in the mouseover text
+        customdata = annot_df.T.fillna("").astype(str).values
 
         # For any text columns, scale to a number
         for cname in annot_df:
@@ -425,9 +424,9 @@ class AbundantOrgs(MicrobiomePlot):
         return go.Heatmap(
             x=annot_df.index.values,
             y=annot_df.columns.values,
-            z=annot_df.T.values,
+            z=annot_df.T.values.astype(np.float32),
             colorscale=annot_cpal,
-            text=text_df.T.values,
-            hoverinfo="text",
+            customdata=customdata,
+            hovertemplate="%{y}: %{customdata}<extra></extra>",
             showscale=False,
         )
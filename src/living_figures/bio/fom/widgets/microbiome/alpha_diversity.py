@@ -1,11 +1,12 @@
 from scipy.stats import entropy, spearmanr, pearsonr, f_oneway
-import streamlit as st
 from typing import Union
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
 from living_figures.helpers.constants import tax_levels
 import widgets.streamlit as wist
 import pandas as pd
 import plotly.express as px
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
 
 
 class AlphaDiversity(MicrobiomePlot):
@@ -14,7 +15,7 @@ class AlphaDiversity(MicrobiomePlot):
     of the mixture of organisms which is present.
 
     Options:
-        - Diversity metric (e.g. Shannon, Simpsons)
+        - Diversity metric (e.g. Shannon, Simpsons, Richness)
         - Taxonomic level
         - Filter samples
         - Display form:
@@ -41,7 +42,8 @@ class AlphaDiversity(MicrobiomePlot):
                             label="Diversity Metric",
                             options=[
                                 "Shannon",
-                                "Simpson"
+                                "Simpson",
+                                "Richness"
                             ],
                             value="Shannon"
                         ),
@@ -103,7 +105,8 @@ class AlphaDiversity(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("statistics")
+    @cache_data(max_entries=10)
     def get_alpha_diversity(_self, **kwargs) -> Union[None, pd.DataFrame]:
         """Return a table with the alpha diversity metrics for each sample."""
 
@@ -121,6 +124,8 @@ class AlphaDiversity(MicrobiomePlot):
         metric = kwargs['metric']
         if metric == "Shannon":
             adiv = _self.calc_shannon(abund)
+        elif metric == "Richness":
+            adiv = _self.calc_richness(abund, kwargs["tax_level"])
         else:
             msg = f"Unrecognized metric = '{metric}"
             assert metric == "Simpson", msg
@@ -135,20 +140,31 @@ class AlphaDiversity(MicrobiomePlot):
             dict(Shannon=(abund / abund.sum()).apply(entropy))
         )
 
+    def calc_richness(self, abund: pd.DataFrame, tax_level: str):
+        """Number of organisms detected, from the summary of each sample"""
+
+        summary = self._root().sample_summary()
+
+        return pd.DataFrame(
+            dict(
+                Richness=summary[f"richness_{tax_level}"].reindex(
+                    index=abund.columns
+                )
+            )
+        )
+
     def calc_simpson(self, abund: pd.DataFrame):
         """Calculate Simpson diversity"""
 
         return pd.DataFrame(
             dict(
-                Simpson=(
-                    abund / abund.sum()
-                ).apply(
-                    lambda c: 1 / c.apply(lambda v: v**2 if v > 0 else 0).sum()
-                )
+                Simpson=1 / (
+                    (abund / abund.sum()).clip(lower=0) ** 2
+                ).sum()
             )
         )
 
-    def run_self(self):
+    def compute(self) -> dict:
 
         # Get all of the ploting parameters
         kwargs = self.all_values(flatten=True)
@@ -170,7 +186,7 @@ class AlphaDiversity(MicrobiomePlot):
         )
 
         if adiv is None:
-            return
+            return dict(fig=None)
 
         # Get the plot
         fig = self.make_fig(
@@ -182,23 +198,33 @@ class AlphaDiversity(MicrobiomePlot):
             }
         )
 
+        # Get any correlation metrics
+        corr_msg = self.report_corr(adiv, kwargs['metric'], kwargs['color_by'])
+
+        return dict(fig=fig, msg=corr_msg, legend=kwargs['legend'])
+
+    def render(self, outputs: dict) -> None:
+
+        if outputs['fig'] is None:
+            return
+
         # Show the plot
-        self.option("plot").main_empty.plotly_chart(fig)
+        self.option("plot").main_empty.plotly_chart(outputs['fig'])
 
         # Print any correlation metrics
-        corr_msg = self.report_corr(adiv, kwargs['metric'], kwargs['color_by'])
-        if corr_msg is not None:
-            self.option("plot_msg").main_empty.write(corr_msg)
+        if outputs['msg'] is not None:
+            self.option("plot_msg").main_empty.write(outputs['msg'])
 
         # If there is a legend
-        if kwargs['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                kwargs['legend']
+                outputs['legend']
             )
 
-    @st.cache_data
+    @timed("statistics")
+    @cache_data
     def report_corr(_self, adiv, metric, color_by):
         """Print any correlation metrics."""
 
@@ -209,12 +235,13 @@ class AlphaDiversity(MicrobiomePlot):
             columns=[metric, color_by]
         ).dropna()
 
-        if self._root()._is_numeric(stats_df[color_by]):
+        if _self._root()._is_numeric(stats_df[color_by]):
             return _self.spearman(stats_df, metric, color_by)
         else:
             return _self.anova(stats_df, metric, color_by)
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def calc_adiv(_self, **kwargs) -> Union[None, pd.DataFrame]:
         """Make the primary figure for plotting."""
 
@@ -241,7 +268,8 @@ class AlphaDiversity(MicrobiomePlot):
 
         return adiv
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def make_fig(_self, adiv, **kwargs):
         """Make the primary figure for plotting."""
 
@@ -1,7 +1,10 @@
 from typing import Any
+import streamlit as st
 import widgets.streamlit as wist
 from widgets.streamlit import StResource
 from widgets.base.exceptions import WidgetFunctionException
+from living_figures.helpers.diagnostics import record_timings
+from living_figures.helpers.tracing import span
 from living_figures.bio.fom.widgets.microbiome.base_widget import BaseMicrobiomeExplorer # noqa
 
 
@@ -11,6 +14,79 @@ class MicrobiomePlot(wist.StResource):
     def _root(self) -> BaseMicrobiomeExplorer:
         return super()._root()
 
+    def run_self(self) -> None:
+        """Compute the contents of the plot and display them."""
+
+        # If the plots are being computed concurrently, the root widget
+        # will render this plot along with all of the other visible plots
+        if self._root().defer_plots():
+            return
+
+        self.render(self.profile_compute())
+
+    def profile_compute(self) -> dict:
+        """
+        Return the output of compute(), recording the time spent in each
+        stage and the size of the figure if diagnostics are enabled.
+        """
+
+        with span(self.id, cat="plot", slot=self.parent.id):
+
+            if not self._root().diagnostics:
+                return self.compute()
+
+            timings = dict()
+            with record_timings(timings):
+                outputs = self.compute()
+
+        # Size of the figure which is sent to the browser
+        fig = outputs.get("fig")
+        payload = 0 if fig is None else len(fig.to_json())
+
+        self._root().record_diagnostics(self, timings, payload)
+
+        return outputs
+
+    def compute(self) -> dict:
+        """
+        Compute the contents of the plot (e.g. the figure and any messages)
+        without writing anything to the display.
+        The keys of the returned dict are specific to each type of plot.
+        """
+
+        return dict()
+
+    def render(self, outputs: dict) -> None:
+        """Display the contents of the plot which were made by compute()."""
+
+        pass
+
+    @staticmethod
+    def render_mode_menu() -> wist.StSelectString:
+        """Menu used to select the render_mode of a scatter plot."""
+
+        return wist.StSelectString(
+            id="render_mode",
+            label="Rendering",
+            options=["Auto", "SVG", "WebGL"],
+            value="Auto",
+            help="Large plots are drawn with WebGL by default"
+        )
+
+    def render_mode(self, n_points: int, mode="Auto", threshold=1000) -> str:
+        """
+        Return the render_mode used for a scatter plot.
+        Plots with more than threshold points are drawn with WebGL,
+        unless the user has selected SVG or WebGL.
+        """
+
+        if mode == "SVG":
+            return "svg"
+        elif mode == "WebGL":
+            return "webgl"
+        else:
+            return "webgl" if n_points > threshold else "svg"
+
     def option(self, id) -> StResource:
         for r in self._find_child(id):
             return r
@@ -19,6 +95,25 @@ class MicrobiomePlot(wist.StResource):
     def val(self, id) -> Any:
         return self.option(id).get_value()
 
+    def selected(self, id) -> Any:
+        """
+        Return the value selected in a menu, including a selection made
+        in a previous run before the options of the menu are updated.
+        """
+
+        value = self.val(id)
+        if value is not None:
+            return value
+
+        # Menus without options have no value until the options are set,
+        # so the selection made in the previous run is used instead
+        return st.session_state.get(self.selection_key(id))
+
+    def selection_key(self, id) -> str:
+        """Key used to keep the selection of a menu between runs."""
+
+        return f"selected_{self._root().id}_{self.parent.id}_{self.id}_{id}"
+
     def update_options(self, options, id):
         """Update the set of options for user-provided metadata."""
 
@@ -26,7 +121,7 @@ class MicrobiomePlot(wist.StResource):
         resource = self.option(id)
 
         # Remove any values which are not in the new options
-        value = resource.get_value()
+        value = self.selected(id)
         if isinstance(value, list):
             value = [i for i in value if i in options]
         else:
@@ -45,8 +140,9 @@ class MicrobiomePlot(wist.StResource):
                 update=self.main_container is not None
             )
 
-        # Regenerate the plot
+        # Keep the selection for the next run, and regenerate the plot
         if self.main_container is not None:
+            st.session_state[self.selection_key(id)] = resource.get_value()
             self.run_self()
 
     def _get_child(self, child_id, *cont) -> 'StResource':
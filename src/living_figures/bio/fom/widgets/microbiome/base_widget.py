@@ -1,13 +1,103 @@
-import streamlit as st
-from typing import List, Union
+import threading
+from typing import List, Set, Tuple, Union
 import numpy as np
 import pandas as pd
 import widgets.streamlit as wist
+from widgets.streamlit import StResource
 from widgets.base.exceptions import WidgetFunctionException
+from living_figures.bio.fom.utilities import alr, alr_reference, clr
+from living_figures.bio.fom.utilities import log_proportions
+from living_figures.helpers.caching import cache_stats
+from living_figures.helpers.concurrency import run_in_background
+from living_figures.helpers.constants import tax_levels
+from living_figures.helpers.concurrency import thread_map
+from living_figures.helpers.diagnostics import timed
+from living_figures.helpers.distances import CondensedDistances
+from living_figures.helpers.distances import pairwise_distances
+from living_figures.helpers.tracing import tracer
+from living_figures.helpers.memory import memory_governor
+from living_figures.helpers.registry import current_session, shared_datasets
+from living_figures.helpers.search import SearchIndex
+
+
+# Inputs (abundance and annotation hashes) for which the default plots
+# have been precomputed in the background, by any session in this process
+warmed_up: Set[Tuple[str, Union[None, str]]] = set()
+warm_up_lock = threading.Lock()
 
 
 class BaseMicrobiomeExplorer(wist.StreamlitWidget):
 
+    # Number of threads used to compute the visible plots concurrently
+    max_workers = 1
+
+    # Record the time spent computing each plot
+    diagnostics = False
+
+    # Precompute the default configuration of each plot after an upload
+    warm_cache = False
+
+    # Numeric precision of the abundances ("float64" or "float32")
+    precision = "float64"
+
+    # Tables with more samples than this are read in batches to fit PCA
+    pca_batch_size = 10000
+
+    def __init__(
+        self,
+        max_workers: Union[int, None] = None,
+        diagnostics: Union[bool, None] = None,
+        warm_cache: Union[bool, None] = None,
+        precision: Union[str, None] = None,
+        pca_batch_size: Union[int, None] = None,
+        **kwargs
+    ):
+        """
+        Args:
+            max_workers (int):  (optional) Number of threads used to compute
+                                the data for all visible plots concurrently.
+                                By default, each plot is computed and
+                                displayed in turn.
+            diagnostics (bool): (optional) Record the time spent computing
+                                each plot, and show a summary in the sidebar.
+            warm_cache (bool):  (optional) After the abundances are uploaded,
+                                compute the default configuration of each
+                                type of plot in a background thread so that
+                                it is cached before being displayed.
+            precision (str):    (optional) Store and compute the relative
+                                abundances as "float32" to halve the memory
+                                used, or "float64" (default).
+            pca_batch_size (int): (optional) Maximum number of samples
+                                copied into memory at once to fit PCA.
+                                Larger tables are read in batches.
+        """
+
+        if max_workers is None:
+            max_workers = self.__class__.max_workers
+        if diagnostics is None:
+            diagnostics = self.__class__.diagnostics
+        if warm_cache is None:
+            warm_cache = self.__class__.warm_cache
+        if precision is None:
+            precision = self.__class__.precision
+        if precision not in ["float64", "float32"]:
+            msg = f"Precision must be float64 or float32, not {precision}"
+            raise WidgetFunctionException(msg)
+        if pca_batch_size is None:
+            pca_batch_size = self.__class__.pca_batch_size
+
+        # Diagnostics recorded for each plot during this run
+        self.plot_diagnostics = dict()
+
+        super().__init__(
+            max_workers=max_workers,
+            diagnostics=diagnostics,
+            warm_cache=warm_cache,
+            precision=precision,
+            pca_batch_size=pca_batch_size,
+            **kwargs
+        )
+
     def msg(self, msg):
         """Write to the message container."""
         if self.main_container is not None:
@@ -18,39 +108,80 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
         Return the abundance table
         """
 
-        # Get the abundances
-        abund: pd.DataFrame = self.get(["data", "abund"])
+        # The sample annotations are only used to apply a filter
+        if filter is None or filter == 'None':
+            filter, annot_hash = 'None', None
+        else:
+            annot_hash = self.annot_hash()
+
+        # The same table is shared by every session with the same inputs,
+        # and must not be modified by the caller
+        return shared_datasets.get(
+            ("abund", self.abund_hash(), annot_hash, level, filter),
+            lambda: self._make_abund(
+                self.get(["data", "abund"]),
+                self.sample_annotations(),
+                level,
+                filter,
+                self.dtype(),
+                # The total of each sample at the selected rank
+                None if level is None else self.sample_summary().get(
+                    f"total_{level}"
+                )
+            )
+        )
 
-        # Get the sample annotations
-        sample_annots = self.sample_annotations()
+    def org_list(self) -> List[str]:
+        """Return the list of organisms parsed from the abundance table."""
 
-        return self._make_abund(abund, sample_annots, level, filter)
+        return self.org_index().entries
 
-    def org_list(self):
-        """Return the list of organisms parsed from the abundance table."""
+    def org_index(self) -> SearchIndex:
+        """Return the search index of organisms, shared for each dataset."""
 
-        return self._make_org_list(
-            self.get(
-                ['data', 'abund'],
-                attr="index_orgs"
+        return shared_datasets.get(
+            ("org_index", self.abund_hash()),
+            lambda: SearchIndex(
+                self._make_org_list(
+                    self.get(['data', 'abund'], attr="index_orgs")
+                )
             )
         )
 
-    @st.cache_data
-    def _make_org_list(_self, index_orgs: pd.DataFrame):
-        return [
-            f"{r['level']}: {r['name']}"
-            for _, r in index_orgs.iterrows()
-            if not pd.isnull(r['level'])
-        ]
+    def search_orgs(self, query: str, selected=None, n=100) -> List[str]:
+        """
+        Return the top n organisms matching a search query,
+        always including the organism which is currently selected.
+        """
+
+        orgs = self.org_index().search(query, n=n)
+
+        if selected is not None and selected not in orgs:
+            orgs = [selected] + orgs
+
+        return orgs
+
+    def _make_org_list(self, index_orgs: pd.DataFrame) -> List[str]:
+
+        if index_orgs is None or index_orgs.shape[0] == 0:
+            return []
+
+        index_orgs = index_orgs.dropna(subset=["level"])
+        return (
+            index_orgs["level"].apply(str) +
+            ": " +
+            index_orgs["name"].apply(str)
+        ).tolist()
 
-    @st.cache_data
+    @timed("data")
     def _make_abund(
-        _self,
+        self,
         abund: pd.DataFrame,
         sample_annots: pd.DataFrame,
         level: str,
-        filter: str
+        filter: str,
+        dtype=np.float64,
+        totals: Union[None, pd.Series] = None
     ) -> pd.DataFrame:
 
         if abund.shape[0] == 0:
@@ -65,7 +196,7 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
         else:
 
             # Get the taxonomic information for each row
-            index_orgs = _self.get(["data", "abund"], attr="index_orgs")
+            index_orgs = self.get(["data", "abund"], attr="index_orgs")
 
             # Filter down to the rows which are assigned at that level
             abund = abund.reindex(
@@ -107,27 +238,339 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
                 ]
             )
 
+        # The total of each sample may be read from the summary table
+        if totals is None:
+            totals = abund.sum()
+        else:
+            totals = totals.reindex(index=abund.columns)
+
         # Remove any samples which sum to 0
         abund = abund.reindex(
             columns=abund.columns.values[
-                abund.sum() > 0
+                totals.values > 0
             ]
         )
+        totals = totals.reindex(index=abund.columns)
 
         if abund.shape[1] == 0:
             return
 
         # Normalize all abundances to percentages
-        abund = 100 * abund / abund.sum()
+        abund = abund.astype(dtype)
+        abund = 100 * abund / totals.astype(dtype)
 
         return abund
 
+    def sample_summary(self) -> pd.DataFrame:
+        """
+        Return a table with a summary of each sample, which is computed
+        once for each dataset and must not be modified. Columns:
+            depth:              Total abundance at the highest rank
+            top_taxon:          Most abundant organism at the lowest rank
+            top_share:          Share (%) of the lowest rank for top_taxon
+            richness_{rank}:    Number of organisms detected at each rank
+            total_{rank}:       Total abundance at each rank
+        """
+
+        return shared_datasets.get(
+            ("sample_summary", self.abund_hash()),
+            lambda: self._make_sample_summary(
+                self.get(["data", "abund"]),
+                self.get(["data", "abund"], attr="index_orgs")
+            )
+        )
+
+    @timed("data")
+    def _make_sample_summary(
+        self,
+        abund: pd.DataFrame,
+        index_orgs: pd.DataFrame
+    ) -> pd.DataFrame:
+
+        summary = pd.DataFrame(index=abund.columns)
+        if abund.shape[0] == 0:
+            return summary
+
+        # Ranks which are present in the data, from highest to lowest
+        levels = index_orgs["level"].reindex(index=abund.index).values
+        ranks = [level for level in tax_levels if (levels == level).any()]
+        if len(ranks) == 0:
+            return summary
+
+        for rank in ranks:
+            rank_vals = abund.values[levels == rank]
+            summary[f"richness_{rank}"] = (rank_vals > 0).sum(axis=0)
+            summary[f"total_{rank}"] = rank_vals.sum(axis=0)
+
+        summary.insert(0, "depth", summary[f"total_{ranks[0]}"])
+
+        # Most abundant organism at the lowest rank
+        rank_vals = abund.values[levels == ranks[-1]]
+        names = index_orgs["name"].reindex(
+            index=abund.index[levels == ranks[-1]]
+        ).values
+        top_ix = rank_vals.argmax(axis=0)
+        top_vals = rank_vals[top_ix, np.arange(rank_vals.shape[1])]
+        totals = summary[f"total_{ranks[-1]}"].values
+        summary.insert(
+            1,
+            "top_taxon",
+            np.where(top_vals > 0, names[top_ix], None)
+        )
+        summary.insert(
+            2,
+            "top_share",
+            100 * top_vals / np.where(totals > 0, totals, np.nan)
+        )
+
+        return summary
+
+    def distances(self, level, filter, metric: str) -> CondensedDistances:
+        """
+        Return the condensed distances between every pair of samples
+        (e.g. "Bray-Curtis" or "braycurtis"), which are shared by every plot
+        and session using the same abundances, and must not be modified.
+        """
+
+        metric = metric.replace("-", "").lower()
+
+        if filter is None or filter == 'None':
+            annot_hash = None
+        else:
+            annot_hash = self.annot_hash()
+
+        return shared_datasets.get(
+            ("distance", self.abund_hash(), annot_hash, level, filter, metric),
+            lambda: self._make_distances(
+                # The Aitchison distance compares CLR-transformed abundances
+                self.transformed(level, filter, "CLR")
+                if metric == "aitchison"
+                else self.abund(level=level, filter=filter),
+                metric
+            )
+        )
+
+    @timed("statistics")
+    def _make_distances(self, abund: pd.DataFrame, metric: str):
+
+        # The Aitchison distance is the Euclidean distance between
+        # samples after the CLR transform
+        if metric == "aitchison":
+            metric = "euclidean"
+
+        # Otherwise, compare the proportions of each organism in each sample
+        else:
+            abund = abund / abund.sum()
+
+        # Compute the distances in tiles with the worker threads
+        # of the explorer, keeping the precision of the abundances
+        n_samples = abund.shape[1]
+        dists = pairwise_distances(
+            abund.T.values,
+            metric=metric,
+            max_workers=max(self.max_workers or 1, 1),
+            out=np.empty(
+                n_samples * (n_samples - 1) // 2,
+                dtype=abund.values.dtype
+            )
+        )
+
+        return CondensedDistances(dists, abund.columns)
+
+    def transformed(self, level, filter='None', transform='None'):
+        """
+        Return the abundances after a compositional transform ("CLR" or
+        "ALR", or "None" for the relative abundances), which are shared
+        by every plot and session using the same abundances, and must
+        not be modified.
+        """
+
+        if transform is None or transform == 'None':
+            return self.abund(level=level, filter=filter)
+
+        if transform not in ["CLR", "ALR"]:
+            msg = f"Transform must be CLR or ALR, not {transform}"
+            raise WidgetFunctionException(msg)
+
+        if filter is None or filter == 'None':
+            filter, annot_hash = 'None', None
+        else:
+            annot_hash = self.annot_hash()
+
+        return shared_datasets.get(
+            (
+                "transformed",
+                self.abund_hash(),
+                annot_hash,
+                level,
+                filter,
+                transform
+            ),
+            lambda: self._make_transformed(
+                self.abund(level=level, filter=filter),
+                self.log_abund(level, filter),
+                transform
+            )
+        )
+
+    def log_abund(self, level, filter='None') -> pd.DataFrame:
+        """
+        Return the log proportions of each organism in each sample after
+        replacing zeros, which are computed once for each set of abundances
+        and shared by each of the compositional transforms.
+        """
+
+        if filter is None or filter == 'None':
+            filter, annot_hash = 'None', None
+        else:
+            annot_hash = self.annot_hash()
+
+        return shared_datasets.get(
+            ("log_abund", self.abund_hash(), annot_hash, level, filter),
+            lambda: self._make_log_abund(
+                self.abund(level=level, filter=filter)
+            )
+        )
+
+    @timed("statistics")
+    def _make_log_abund(self, abund: pd.DataFrame) -> pd.DataFrame:
+
+        if abund is None:
+            return
+
+        # Keep the precision of the abundances
+        return log_proportions(abund).astype(self.dtype())
+
+    def _make_transformed(
+        self,
+        abund: pd.DataFrame,
+        log_abund: pd.DataFrame,
+        transform: str
+    ) -> pd.DataFrame:
+
+        if abund is None:
+            return
+
+        if transform == "CLR":
+            return clr(log_abund)
+
+        # The reference of the ALR is the most prevalent organism
+        return alr(log_abund, alr_reference(abund))
+
+    def taxonomy_nodes(self, filter='None', group_by='None') -> pd.DataFrame:
+        """
+        Return a table with the mean relative abundance (%) and prevalence
+        (% of samples) of every node in the taxonomy, for each group of
+        samples, which is shared by every session with the same inputs.
+        """
+
+        if group_by is None or group_by == 'None':
+            group_by = None
+        if group_by is None and (filter is None or filter == 'None'):
+            annot_hash = None
+        else:
+            annot_hash = self.annot_hash()
+
+        def make_nodes():
+            if group_by is None:
+                groups = None
+            else:
+                groups = self.sample_annotations()[group_by]
+            return self._make_taxonomy_nodes(
+                self.abund(filter=filter),
+                self.get(["data", "abund"], attr="index_orgs"),
+                groups
+            )
+
+        key = ("taxonomy_nodes", self.abund_hash(), annot_hash, filter)
+        return shared_datasets.get(key + (group_by,), make_nodes)
+
+    @timed("data")
+    def _make_taxonomy_nodes(
+        self,
+        abund: Union[None, pd.DataFrame],
+        index_orgs: pd.DataFrame,
+        groups: Union[None, pd.Series]
+    ) -> pd.DataFrame:
+
+        cnames = [
+            "id", "parent", "label", "level", "depth",
+            "group", "n_samples", "mean", "prevalence"
+        ]
+        if abund is None:
+            return pd.DataFrame(columns=cnames)
+
+        # The parent of each node is its closest ancestor in the table
+        # (using an empty string for the nodes at the top of the tree)
+        paths = set(abund.index.values)
+        parents = dict()
+        depths = dict()
+        for path in sorted(abund.index.values, key=lambda p: p.count("|")):
+            ancestors = path.split("|")[:-1]
+            parent = ""
+            while len(ancestors) > 0:
+                if "|".join(ancestors) in paths:
+                    parent = "|".join(ancestors)
+                    break
+                ancestors = ancestors[:-1]
+            parents[path] = parent
+            depths[path] = 1 if parent == "" else depths[parent] + 1
+
+        nodes = pd.DataFrame(
+            dict(
+                parent=pd.Series(parents),
+                depth=pd.Series(depths)
+            )
+        ).reindex(index=abund.index)
+
+        # Scale each sample to the total abundance of the top-level nodes
+        totals = abund.loc[nodes["parent"] == ""].sum()
+        rel = 100 * abund / totals
+
+        # Each group of samples is summarized separately
+        if groups is None:
+            groups = pd.Series("All Samples", index=rel.columns)
+        groups = groups.reindex(index=rel.columns).dropna()
+
+        tables = []
+        for group, samples in groups.groupby(groups).groups.items():
+            group_rel = rel.reindex(columns=samples)
+            tables.append(
+                nodes.assign(
+                    group=str(group),
+                    n_samples=len(samples),
+                    mean=group_rel.mean(axis=1),
+                    prevalence=100 * (group_rel > 0).mean(axis=1)
+                ).query("mean > 0")
+            )
+
+        if len(tables) == 0:
+            return pd.DataFrame(columns=cnames)
+
+        return pd.concat(tables).rename_axis(
+            index="id"
+        ).reset_index().assign(
+            label=lambda d: d["id"].apply(index_orgs["name"].get),
+            level=lambda d: d["id"].apply(index_orgs["level"].get)
+        ).reindex(columns=cnames)
+
+    def dtype(self) -> type:
+        """Return the numeric type used for the relative abundances."""
+
+        return np.float32 if self.precision == "float32" else np.float64
+
     def abund_hash(self) -> pd.DataFrame:
         """
-        Return the hash of the abundance table
+        Return the hash of the abundance table, which also identifies
+        the precision used for any computations made with it.
         """
 
-        return self.get(["data", "abund"], attr="hash")
+        abund_hash = self.get(["data", "abund"], attr="hash")
+
+        if abund_hash is not None and self.precision != "float64":
+            abund_hash = f"{abund_hash}-{self.precision}"
+
+        return abund_hash
 
     def annot_hash(self) -> pd.DataFrame:
         """
@@ -137,7 +580,18 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
         return self.get(["data", "annots"], attr="hash")
 
     def sample_annotations(self) -> Union[None, pd.DataFrame]:
-        """Return the table of sample annotations."""
+        """
+        Return the table of sample annotations, which is shared by every
+        session with the same data and must not be modified.
+        """
+
+        return shared_datasets.get(
+            ("sample_annotations", self.abund_hash(), self.annot_hash()),
+            self._make_sample_annotations
+        )
+
+    @timed("data")
+    def _make_sample_annotations(self) -> Union[None, pd.DataFrame]:
 
         # Get the value of the sample annotation resource
         annots: pd.DataFrame = self.get(["data", "annots"])
@@ -182,29 +636,34 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
         # Return the data which passes this filtering regime
         return annots
 
-    def sample_filters(self, max_categories=10) -> List[str]:
-        """Return the list of possible filters based on sample metadata."""
+    def metadata_profile(self) -> pd.DataFrame:
+        """
+        Return a table describing each column of sample metadata,
+        which is computed once for each dataset.
+        """
 
-        # Get all of the sample annotations provided by the user
-        annots = self.sample_annotations()
+        return shared_datasets.get(
+            ("metadata_profile", self.abund_hash(), self.annot_hash()),
+            lambda: self._make_metadata_profile(self.sample_annotations())
+        )
+
+    def _make_metadata_profile(
+        self,
+        annots: Union[None, pd.DataFrame]
+    ) -> pd.DataFrame:
 
-        # Build a list of possible filters
-        filters = ['None']
+        profile = []
 
-        if annots is None or annots.shape[1] == 0:
-            return filters
+        if annots is None:
+            annots = pd.DataFrame()
 
-        # For each category of metadata
         for cname, cvals in annots.items():
 
             # Get the unique values
             unique_vals = cvals.dropna().unique()
 
-            # Skip if there are > max_categories values
-            if unique_vals.shape[0] > max_categories:
-                continue
-
-            # Add each value to the list of filters
+            # Format the filters which could be applied for each value
+            filters = []
             for uval in unique_vals:
 
                 # Wrap strings in quotes
@@ -218,72 +677,317 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
                     f"{cname} != {filter_val}"
                 ])
 
-        return filters
+            profile.append(dict(
+                name=cname,
+                n_unique=unique_vals.shape[0],
+                unique_values=list(unique_vals),
+                is_numeric=self._root()._is_numeric(cvals),
+                filters=filters
+            ))
+
+        return pd.DataFrame(
+            profile,
+            columns=[
+                "name",
+                "n_unique",
+                "unique_values",
+                "is_numeric",
+                "filters"
+            ]
+        )
+
+    def sample_filters(self, max_categories=10) -> List[str]:
+        """Return the list of possible filters based on sample metadata."""
+
+        return list(shared_datasets.get(
+            (
+                "sample_filters",
+                self.abund_hash(),
+                self.annot_hash(),
+                max_categories
+            ),
+            lambda: ['None'] + [
+                filter_str
+                for _, col in self.metadata_profile().iterrows()
+                # Skip if there are > max_categories values
+                if col["n_unique"] <= max_categories
+                for filter_str in col["filters"]
+            ]
+        ))
 
     def sample_colors(self, max_categories=10, include_none=True) -> List[str]:
         """Return the list of plot colorings based on sample metadata."""
 
-        # Get all of the sample annotations provided by the user
-        annots = self.sample_annotations()
+        colors = shared_datasets.get(
+            (
+                "sample_colors",
+                self.abund_hash(),
+                self.annot_hash(),
+                max_categories
+            ),
+            lambda: [
+                col["name"]
+                for _, col in self.metadata_profile().iterrows()
+                # Numeric columns, or categorical columns
+                # with no more than max_categories values
+                if col["is_numeric"] or col["n_unique"] <= max_categories
+            ]
+        )
 
-        # Build a list of possible colors
-        colors = ['None'] if include_none else []
+        return (['None'] if include_none else []) + colors
 
-        if annots is None or annots.shape[1] == 0:
-            return colors
+    def plot_types(self) -> List[str]:
+        """Return the id used for each type of plot."""
 
-        # For each category of metadata
-        for cname, cvals in annots.items():
+        return [
+            "ordination",
+            "abundant_orgs",
+            "alpha_diversity",
+            "beta_diversity",
+            "differential_abundance",
+            "single_organism",
+            "compare_two_organisms",
+            "taxonomy_tree",
+        ]
 
-            # If the column is numeric
-            if self._root()._is_numeric(cvals):
+    def find_plots(self, resource=None):
+        """Yield every plot element, in the order in which it is displayed."""
 
-                # Add it to the list
-                colors.append(cname)
+        if resource is None:
+            resource = self
 
-            # If it is categorical
-            else:
+        if resource.id in self.plot_types():
+            yield resource
+        else:
+            for child in resource.children:
+                yield from self.find_plots(child)
+
+    def visible_plots(self, plot_type=None) -> List[StResource]:
+        """
+        Return each plot which is displayed on the page, in order.
+        Plots in unselected options or hidden slots do not have a container.
+        """
+
+        return [
+            plot_elem
+            for plot_elem in self.find_plots()
+            if plot_elem.main_container is not None
+            and (plot_type is None or plot_elem.id == plot_type)
+        ]
 
-                # Get the unique values
-                unique_vals = cvals.dropna().unique()
+    def defer_plots(self) -> bool:
+        """
+        Plots are only displayed by run_plots() if they are being
+        computed concurrently by more than one worker thread.
+        """
 
-                # If there are no more than max_categories values
-                if unique_vals.shape[0] <= max_categories:
+        return self.max_workers is not None and self.max_workers > 1
 
-                    # Add it to the list
-                    colors.append(cname)
+    def run_plots(self) -> None:
+        """
+        Compute the data for every visible plot concurrently,
+        and then display each of the plots in order.
+        """
 
-        return colors
+        # If the plots are not deferred, they have already been displayed
+        if not self.defer_plots():
+            return
+
+        plots = self.visible_plots()
+
+        # Compute the contents of each plot on a pool of threads
+        outputs = thread_map(
+            lambda plot_elem: plot_elem.profile_compute(),
+            plots,
+            max_workers=self.max_workers
+        )
+
+        # Display the plots in order
+        for plot_elem, plot_outputs in zip(plots, outputs):
+            plot_elem.render(plot_outputs)
+
+    def default_plot(self, plot_type: str) -> StResource:
+        """
+        Return a new plot of the given type with the default options,
+        attached to the widget in the same location as the first plot
+        of that type (without being displayed).
+        """
+
+        for plot_elem in self.find_plots():
+            if plot_elem.id == plot_type:
+                plot_copy = plot_elem.__class__(id=plot_elem.id)
+                plot_copy.parent = plot_elem.parent
+                return plot_copy
+
+        raise WidgetFunctionException(f"Plot type not found: {plot_type}")
+
+    def warm_up(self) -> Union[None, threading.Thread]:
+        """
+        Compute the default configuration of each type of plot in a
+        background thread, populating the cache while the user is still
+        looking at the input data.
+
+        The warm-up is only started once for each combination of abundances
+        and annotations (by any session), and should be started after both
+        have been read. Returns the thread, if one was started.
+        """
+
+        if not self.warm_cache:
+            return
+
+        # The inputs are identified before the thread is started
+        abund_hash = self.abund_hash()
+        annot_hash = self.annot_hash()
+
+        if abund_hash is None:
+            return
+
+        with warm_up_lock:
+            if (abund_hash, annot_hash) in warmed_up:
+                return
+            warmed_up.add((abund_hash, annot_hash))
+
+        return self._start_warm_up(abund_hash, annot_hash)
+
+    def _start_warm_up(
+        self,
+        abund_hash: str,
+        annot_hash: Union[None, str]
+    ) -> Union[None, threading.Thread]:
+
+        # Make a copy of each type of plot with the default options
+        plots = [
+            self.default_plot(plot_type)
+            for plot_type in self.plot_types()
+        ]
+
+        def compute(plot_elem: StResource):
+
+            # Skip the plot if the inputs have changed since the
+            # warm-up was started, so that nothing is cached for
+            # a combination of inputs which was not requested
+            if (
+                self.abund_hash() != abund_hash
+                or self.annot_hash() != annot_hash
+            ):
+                return
+
+            # Errors will be reported when the plot is displayed
+            try:
+                plot_elem.compute()
+            except Exception:
+                pass
+
+        return run_in_background(
+            lambda: thread_map(
+                compute,
+                plots,
+                max_workers=self.max_workers
+            )
+        )
+
+    def record_diagnostics(
+        self,
+        plot_elem: StResource,
+        timings: dict,
+        payload: int
+    ) -> None:
+        """Add the time spent computing a plot to the diagnostics."""
+
+        # Each plot is identified by the slot which contains it
+        slot = plot_elem.parent.id
+
+        record = self.plot_diagnostics.get(slot)
+        if record is None or record["Plot"] != plot_elem.label:
+            record = {"Plot": plot_elem.label}
+            self.plot_diagnostics[slot] = record
+
+        # A plot may be computed more than once in each run
+        for stage in ["data", "statistics", "figure", "total"]:
+            record[stage] = record.get(stage, 0.) + timings.get(stage, 0.)
+        record["payload"] = payload
+
+    def plot_timings(self) -> pd.DataFrame:
+        """
+        Return a table with the wall time (seconds) spent in each stage of
+        computing every plot during this run, along with the size of the
+        figure (bytes) which is sent to the browser.
+        """
+
+        return pd.DataFrame(
+            [
+                {
+                    "Slot": slot,
+                    "Plot": record["Plot"],
+                    "Data (s)": record["data"],
+                    "Statistics (s)": record["statistics"],
+                    "Figure (s)": record["figure"],
+                    "Total (s)": record["total"],
+                    "Figure Size (bytes)": record["payload"]
+                }
+                for slot, record in self.plot_diagnostics.items()
+            ],
+            columns=[
+                "Slot",
+                "Plot",
+                "Data (s)",
+                "Statistics (s)",
+                "Figure (s)",
+                "Total (s)",
+                "Figure Size (bytes)"
+            ]
+        )
+
+    def show_diagnostics(self) -> None:
+        """Show the diagnostics panel in the sidebar (if enabled)."""
+
+        if not self.diagnostics:
+            return
+
+        panel = self.sidebar_container.expander("Diagnostics")
+        panel.write("Time spent computing each plot")
+        panel.dataframe(self.plot_timings().set_index("Slot"))
+        panel.write("Cache hits and misses")
+        panel.dataframe(cache_stats().set_index("Function"))
+        panel.write("Memory used by all caches")
+        panel.dataframe(memory_governor.usage().set_index("Group"))
+        panel.write(
+            f"Total: {memory_governor.total_bytes() / 2**20:,.1f} MB "
+            f"of {memory_governor.budget / 2**20:,.0f} MB"
+        )
+
+        # The trace of the spans recorded for this session
+        if tracer.enabled:
+            panel.download_button(
+                "Download trace",
+                tracer.to_json(session=current_session()),
+                file_name="trace.json",
+                mime="application/json",
+                help="Chrome trace-event JSON, for viewing in a trace viewer"
+            )
 
     def update_options(self) -> None:
         """Update the menu selection items based on the user inputs."""
 
-        # Update the color_by and filter_by fields of all appropriate elements
-        for plot_type in [
-            "ordination",
-            "abundant_orgs",
-            "alpha_diversity",
-            "beta_diversity",
-            "differential_abundance",
-            "single_organism",
-            "compare_two_organisms",
-        ]:
+        # Plots which are not being displayed are skipped entirely,
+        # and will be updated once they become visible
+        plots = self.visible_plots()
 
-            # For each of the elements of this type
-            for plot_elem in self._find_child(plot_type):
+        # Update the color_by and filter_by fields of all appropriate elements
+        for plot_elem in plots:
 
-                # Update the 'color_by' and 'filter_by' menu options
+            # Update the 'color_by' and 'filter_by' menu options
 
-                # Update the sample colors
-                plot_elem.update_options(
-                    self.sample_colors(
-                        # Only include a "None" value for ordination
-                        include_none=plot_type != "abundant_orgs"
-                    ),
-                    "color_by"
-                )
-                # Update the filter_by for all plot types
-                plot_elem.update_options(self.sample_filters(), "filter_by")
+            # Update the sample colors
+            plot_elem.update_options(
+                self.sample_colors(
+                    # Only include a "None" value for ordination
+                    include_none=plot_elem.id != "abundant_orgs"
+                ),
+                "color_by"
+            )
+            # Update the filter_by for all plot types
+            plot_elem.update_options(self.sample_filters(), "filter_by")
 
         # Update the organism list
         for plot_type, menu_name in [
@@ -292,11 +996,15 @@ class BaseMicrobiomeExplorer(wist.StreamlitWidget):
             ("compare_two_organisms", "org2"),
         ]:
 
-            # For each of the elements of this type
-            for plot_elem in self._find_child(plot_type):
+            # For each of the visible elements of this type
+            for plot_elem in self.visible_plots(plot_type):
 
-                # Update the 'org' selector
+                # Update the 'org' selector with the organisms
+                # which match the search query
                 plot_elem.update_options(
-                    self.org_list(),
+                    self.search_orgs(
+                        plot_elem.val(f"{menu_name}_search"),
+                        selected=plot_elem.selected(menu_name)
+                    ),
                     menu_name
                 )
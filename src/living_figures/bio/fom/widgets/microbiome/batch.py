@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Render figures from the Microbiome Explorer without a browser.
+
+The batch is described by a JSON file listing the datasets and the
+figures to make from each of them, for example:
+
+    {
+        "datasets": [
+            {
+                "name": "CMD_STEC",
+                "abund": "CMD_STEC.abund.csv",
+                "annots": "CMD_STEC.annot.csv"
+            }
+        ],
+        "figures": [
+            {
+                "name": "pca_genus",
+                "plot": "ordination",
+                "params": {"tax_level": "genus"}
+            }
+        ],
+        "formats": ["html", "json", "png"],
+        "output": "figures",
+        "explorer": {"precision": "float32"}
+    }
+
+Each figure is computed for every dataset in a pool of processes, and
+written to {output}/{dataset}/{figure}.{format}. The params of each figure
+are the ids and values of the options of that plot (any options which are
+not set keep their default values). File paths are relative to the
+location of the JSON file. The figures of each dataset are split between
+the workers, and each worker process reads a dataset only once.
+
+    python -m living_figures.bio.fom.widgets.microbiome.batch batch.json
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import sys
+from typing import Dict, List, Tuple
+from living_figures.bio.fom.widgets.microbiome.main import MicrobiomeExplorer
+
+FORMATS = ["html", "json", "png"]
+
+# Explorer with the most recently used dataset in this process
+_explorers: Dict[str, MicrobiomeExplorer] = dict()
+
+
+def load_config(fp: Path) -> dict:
+    """Read the JSON description of the batch, resolving file paths."""
+
+    with open(fp) as handle:
+        config = json.load(handle)
+
+    for kw in ["datasets", "figures"]:
+        if len(config.get(kw, [])) == 0:
+            raise ValueError(f"No {kw} listed in {fp}")
+
+    # Every dataset needs an abundance table, and every figure
+    # needs a name and a type of plot
+    required_keys = dict(datasets=["abund"], figures=["name", "plot"])
+    for kw, required in required_keys.items():
+        for ix, item in enumerate(config[kw]):
+            for key in required:
+                if not isinstance(item, dict) or item.get(key) is None:
+                    msg = f"Entry {ix + 1} of {kw} in {fp} has no {key}"
+                    raise ValueError(msg)
+
+    # Paths are relative to the location of the configuration
+    folder = Path(fp).absolute().parent
+    for dataset in config["datasets"]:
+        for kw in ["abund", "annots"]:
+            if dataset.get(kw) is not None:
+                dataset[kw] = str(folder / dataset[kw])
+                if not os.path.exists(dataset[kw]):
+                    raise ValueError(f"File not found: {dataset[kw]}")
+        if dataset.get("name") is None:
+            dataset["name"] = Path(dataset["abund"]).name.split(".")[0]
+
+    # Figures are written to {output}/{dataset}/{figure}.{format},
+    # so the names must be unique
+    for kw in ["datasets", "figures"]:
+        names = [item["name"] for item in config[kw]]
+        for name in set(names):
+            if names.count(name) > 1:
+                raise ValueError(f"Duplicate name in {kw}: {name}")
+
+    if config.get("output") is not None:
+        config["output"] = str(folder / config["output"])
+
+    for fmt in config.get("formats", FORMATS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Output format not recognized: {fmt}")
+
+    return config
+
+
+def load_explorer(dataset: dict, explorer_kwargs: dict) -> MicrobiomeExplorer:
+    """
+    Return an explorer with a dataset loaded, reusing the explorer
+    from the previous task if it was made with the same dataset.
+    """
+
+    key = json.dumps([dataset, explorer_kwargs], sort_keys=True)
+
+    if key not in _explorers:
+
+        # Only keep the most recent dataset in memory
+        _explorers.clear()
+
+        logging.info(f"Loading data from {dataset['abund']}")
+        explorer = MicrobiomeExplorer(**explorer_kwargs)
+        explorer._get_child("data", "abund").parse_files(
+            Path(dataset["abund"])
+        )
+        if dataset.get("annots") is not None:
+            logging.info(f"Loading data from {dataset['annots']}")
+            explorer._get_child("data", "annots").parse_files(
+                Path(dataset["annots"])
+            )
+
+        _explorers[key] = explorer
+
+    return _explorers[key]
+
+
+def render_figure(task: Tuple[dict, dict, dict]) -> dict:
+    """
+    Compute a single figure from a single dataset and write it to disk.
+    Each task is made up of the dataset (its name and file paths),
+    the figure, and the settings of the batch (see task_settings).
+    Returns the files which were written, along with any errors.
+    """
+
+    dataset, figure, settings = task
+
+    result = dict(
+        dataset=dataset["name"],
+        figure=figure["name"],
+        files=[],
+        errors=[]
+    )
+
+    try:
+        explorer = load_explorer(dataset, settings["explorer"])
+
+        # Make a copy of the plot and set its options
+        plot = explorer.default_plot(figure["plot"])
+        for option_id, value in figure.get("params", dict()).items():
+            plot.option(option_id).set(value=value, update=False)
+
+        outputs = plot.compute()
+    except Exception as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+        return result
+
+    fig = outputs.get("fig")
+    if fig is None:
+        msg = outputs.get("msg", outputs.get("prompt"))
+        result["errors"].append(f"No figure was made ({msg})")
+        return result
+
+    folder = Path(settings["output"]) / dataset["name"]
+    os.makedirs(folder, exist_ok=True)
+
+    # Errors writing one format (e.g. a missing image engine)
+    # do not prevent the other formats from being written
+    for fmt in settings["formats"]:
+        fp = folder / f"{figure['name']}.{fmt}"
+        try:
+            if fmt == "html":
+                fig.write_html(fp, include_plotlyjs="cdn")
+            elif fmt == "json":
+                fig.write_json(fp)
+            else:
+                fig.write_image(fp)
+        except Exception as e:
+            result["errors"].append(f"{fp.name}: {type(e).__name__}: {e}")
+        else:
+            result["files"].append(str(fp))
+
+    return result
+
+
+def task_settings(config: dict) -> dict:
+    """
+    Settings of the batch which are sent to the workers along with
+    each figure (rather than the entire configuration).
+    """
+
+    return dict(
+        output=config.get("output", "figures"),
+        formats=config.get("formats", FORMATS),
+        explorer=config.get("explorer", dict())
+    )
+
+
+def run_batch(config: dict, workers: int = 1) -> List[dict]:
+    """
+    Render every figure for every dataset, using a pool of processes
+    if more than one worker is requested.
+    """
+
+    # Tasks are ordered by dataset, and the figures for each dataset are
+    # split into chunks so that every worker has something to do.
+    # Each worker process only reads a dataset once, when it first
+    # receives one of its figures.
+    settings = task_settings(config)
+    tasks = [
+        (dataset, figure, settings)
+        for dataset in config["datasets"]
+        for figure in config["figures"]
+    ]
+    chunksize = max(1, min(
+        len(config["figures"]),
+        math.ceil(len(tasks) / max(workers, 1))
+    ))
+
+    if workers <= 1:
+        return [render_figure(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(render_figure, tasks, chunksize=chunksize)
+        )
+
+
+def main(args=None) -> int:
+
+    parser = argparse.ArgumentParser(
+        description="Render figures from the Microbiome Explorer"
+    )
+    parser.add_argument("config", help="JSON file describing the batch")
+    parser.add_argument("--output", help="Folder used for the figures")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes used to render figures"
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=FORMATS,
+        help="Formats written for each figure"
+    )
+    args = parser.parse_args(args)
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    config = load_config(Path(args.config))
+    if args.output is not None:
+        config["output"] = str(Path(args.output).absolute())
+    if args.formats is not None:
+        config["formats"] = args.formats
+
+    n_tasks = len(config["datasets"]) * len(config["figures"])
+    logging.info(f"Rendering {n_tasks:,} figures with {args.workers} workers")
+
+    results = run_batch(config, workers=args.workers)
+
+    n_failed = 0
+    for result in results:
+        for fp in result["files"]:
+            logging.info(f"Saved {fp}")
+        for error in result["errors"]:
+            logging.error(f"{result['dataset']} {result['figure']}: {error}")
+        n_failed += len(result["errors"]) > 0
+
+    logging.info(f"Done ({n_failed:,} of {n_tasks:,} figures had errors)")
+
+    return 1 if n_failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,14 @@
-from typing import Union
+from typing import Tuple, Union
 import numpy as np
 import widgets.streamlit as wist
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
 import pandas as pd
 import plotly.express as px
-from scipy.spatial import distance
 from scipy import stats
-import streamlit as st
 from living_figures.helpers.constants import tax_levels
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.distances import CondensedDistances
+from living_figures.helpers.diagnostics import timed
 
 
 class BetaDiversity(MicrobiomePlot):
@@ -27,7 +28,8 @@ class BetaDiversity(MicrobiomePlot):
                             options=[
                                 'Bray-Curtis',
                                 'Euclidean',
-                                'Jensen-Shannon'
+                                'Jensen-Shannon',
+                                'Aitchison'
                             ],
                             value='Bray-Curtis'
                         ),
@@ -66,7 +68,7 @@ class BetaDiversity(MicrobiomePlot):
                             max_value=100,
                             value=20
                         ),
-                        wist.StResource()
+                        MicrobiomePlot.render_mode_menu()
                     ]
                 ),
                 wist.StColumns(
@@ -83,21 +85,21 @@ class BetaDiversity(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_distances(
         _self,
-        abund: pd.DataFrame,
+        tax_level: str,
+        filter_by: str,
+        abund_hash: str,
         sample_annots: pd.DataFrame,
         color_by: Union[None, str],
         metric: str
     ) -> str:
         """Compare samples on the basis of a metadata annotation."""
 
-        # Compute the distance matrix
-        dm = _self.make_dm(
-            abund / abund.sum(),
-            metric.replace("-", "").lower()
-        )
+        # Get the distances, which are shared with the PCoA ordination
+        dists = _self._root().distances(tax_level, filter_by, metric)
 
         # If a comparison metric was selected
         if color_by is not None:
@@ -107,149 +109,144 @@ class BetaDiversity(MicrobiomePlot):
 
             # Filter the distances to just those samples with
             # valid metadata
-            dm = dm.reindex(
-                index=meta.index.values,
-                columns=meta.index.values
-            )
+            dists = dists.subset(meta.index)
 
-        # Melt it into long format
-        dm = _self.melt_dm(dm)
+        # One row for each pair of samples
+        plot_df = pd.DataFrame(dict(value=dists.values))
 
         # If a comparison metric was selected
         if color_by is not None:
 
             # Add a label for that comparison
-            if self._root()._is_numeric(sample_annots[color_by]):
-                comparison_values = dm.apply(
-                    lambda r: _self.delta_meta(
-                        r, sample_annots[color_by]
-                    ),
-                    axis=1
-                )
-                if comparison_values.apply(
-                    lambda v: v in [0., 1.]
-                ).all():
-                    comparison_values = comparison_values.apply(
-                        {
-                            0.: "Same",
-                            1.: "Different"
-                        }.get
-                    )
+            if _self._root()._is_numeric(sample_annots[color_by]):
+                comparison_values = _self.delta_meta(dists, meta)
+                if np.isin(comparison_values, [0., 1.]).all():
+                    comparison_values = pd.Categorical.from_codes(
+                        comparison_values.astype(np.int8),
+                        categories=["Same", "Different"]
+                    ).remove_unused_categories()
             else:
-                comparison_values = dm.apply(
-                    lambda r: _self.label_meta(
-                        r, sample_annots[color_by]
-                    ),
-                    axis=1
-                )
+                comparison_values = _self.label_meta(dists, meta)
 
-            dm = dm.assign(
+            plot_df = plot_df.assign(
                 **{color_by: comparison_values}
             )
 
-        # Return the melted the distance matrix
-        return dm
+        return plot_df
 
-    def delta_meta(self, r, meta):
+    def pair_values(
+        self,
+        dists: CondensedDistances,
+        meta: pd.Series
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the metadata values of both samples in each pair."""
+
+        first, second = dists.pairs()
+        values = meta.reindex(index=dists.samples).values
+
+        return values[first], values[second]
+
+    def pair_codes(
+        self,
+        dists: CondensedDistances,
+        meta: pd.Series
+    ) -> Tuple[np.ndarray, np.ndarray, pd.Index]:
         """
-        Format a label describing the samples being compared
-        in terms of their associated metadata values.
+        Return the categorical code of the metadata value of both samples
+        in each pair (-1 if missing), along with the sorted categories.
         """
 
-        return np.abs(meta[r['index']] - meta[r['variable']])
+        meta = meta.astype("category")
+        codes = pd.Series(meta.cat.codes.values, index=meta.index).reindex(
+            index=dists.samples
+        ).fillna(-1).values.astype(np.int64)
+
+        first, second = dists.pairs()
+
+        return codes[first], codes[second], meta.cat.categories
 
-    def label_meta(self, r, meta):
+    def delta_meta(self, dists: CondensedDistances, meta: pd.Series):
         """
-        Format a label describing the samples being compared
-        in terms of their associated metadata values.
+        Return the absolute difference between the metadata
+        values of the samples in each pair.
         """
 
-        minlabel = min(meta[r['index']], meta[r['variable']])
-        maxlabel = max(meta[r['index']], meta[r['variable']])
-
-        if minlabel == maxlabel:
-            return f"Within {minlabel}"
-        else:
-            return f"{minlabel} vs. {maxlabel}"
+        first, second = self.pair_values(dists, meta)
+        return np.abs(first - second)
 
-    @st.cache_data(max_entries=10)
-    def make_dm(
-        _self,
-        abund: pd.DataFrame,
-        metric
-    ):
-        """Make a distance matrix"""
+    def label_meta(self, dists: CondensedDistances, meta: pd.Series):
+        """
+        Format a label describing the samples being compared
+        in terms of their associated metadata values.
+        """
 
-        return pd.DataFrame(
-            distance.squareform(
-                distance.pdist(
-                    abund.T,
-                    metric=metric
-                )
-            ),
-            index=abund.columns,
-            columns=abund.columns
-        )
+        first, second, categories = self.pair_codes(dists, meta)
+        n_categories = len(categories)
+
+        # Each combination of categories is numbered (lower value first)
+        is_missing = np.minimum(first, second) < 0
+        pair_codes = (
+            np.minimum(first, second) * n_categories
+            + np.maximum(first, second)
+        ).clip(min=0)
+
+        # Only the combinations which are present are labeled
+        is_used = np.bincount(
+            pair_codes[~is_missing],
+            minlength=n_categories ** 2
+        ) > 0
+        used_codes = np.flatnonzero(is_used)
+        labels = [
+            f"Within {categories[code // n_categories]}"
+            if code // n_categories == code % n_categories
+            else (
+                f"{categories[code // n_categories]} vs. "
+                f"{categories[code % n_categories]}"
+            )
+            for code in used_codes
+        ]
 
-    @st.cache_data(max_entries=10)
-    def melt_dm(
-        _self,
-        dm: pd.DataFrame
-    ):
-        """Melt a distance matrix"""
+        # Renumber the combinations which are present
+        # (pairs missing a value are labeled as NaN)
+        renumbered = np.cumsum(is_used) - 1
 
-        return dm.reset_index().melt(
-            id_vars=["index"],
-            value_name="value"
-        ).query(
-            "index < variable"
+        return pd.Categorical.from_codes(
+            np.where(is_missing, -1, renumbered[pair_codes]),
+            categories=labels
         )
 
     def compare_beta_div_numeric(
         _self,
-        dm_long: pd.DataFrame,
+        dists: CondensedDistances,
         meta: pd.Series
     ) -> str:
 
         # Compute the difference in metadata value for each
-        dm_long = dm_long.assign(
-            delta=dm_long.apply(
-                lambda r: meta[r['index']] - meta[r['variable']],
-                axis=1
-            ).abs()
-        )
+        delta = _self.delta_meta(dists, meta)
 
-        return stats.spearmanr(dm_long['value'], dm_long['delta'])
+        return stats.spearmanr(dists.values, delta)
 
     def compare_beta_div_categorical(
         _self,
-        dm_long: pd.DataFrame,
+        dists: CondensedDistances,
         meta: pd.Series
     ) -> str:
 
         # Assign each comparison as being within vs. between groups
-        dm_long = dm_long.assign(
-            category=dm_long.apply(
-                lambda r: f"Within {meta[r['index']]}" if meta[r['index']] == meta[r['variable']] else "Between Groups", # noqa
-                axis=1
-            ),
-            is_same=lambda d: d["category"] == "Between Groups"
-        )
+        first, second, _ = _self.pair_codes(dists, meta)
+        is_within = (first == second) & (first >= 0)
 
-        # Test if the distances are different within vs. between groups
-        grouped_vals = {
-            is_same: groupvals["value"].tolist()
-            for is_same, groupvals in dm_long.groupby(dm_long["is_same"])
-        }
+        # Test if the distances are smaller between vs. within groups
+        values = dists.values
         r = stats.mannwhitneyu(
-            grouped_vals[True],
-            grouped_vals[False],
+            values[~is_within],
+            values[is_within],
             alternative="less"
         )
 
         return r
 
-    def run_self(self) -> None:
+    def compute(self) -> dict:
 
         # Get all of the plotting parameters
         params = self.all_values(flatten=True)
@@ -272,40 +269,52 @@ class BetaDiversity(MicrobiomePlot):
         else:
 
             fig = self.build_fig(
-                abund,
+                params["tax_level"],
+                params["filter_by"],
+                self._root().abund_hash(),
                 sample_annots,
                 params["color_by"],
                 params["title"],
                 params["metric"],
-                params["nbins"]
+                params["nbins"],
+                params["render_mode"]
             )
             msg = None
 
+        return dict(fig=fig, msg=msg, legend=params["legend"])
+
+    def render(self, outputs: dict) -> None:
+
+        msg = outputs["msg"]
         if msg is not None and len(msg) > 0:
             self._get_child("ord_msg").main_empty.write(msg)
-        if fig is None:
+        if outputs["fig"] is None:
             return
 
         # Add the plot to the display
-        self._get_child("plot").main_empty.plotly_chart(fig)
+        self._get_child("plot").main_empty.plotly_chart(outputs["fig"])
 
         # If there is a legend
-        if params['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                params['legend']
+                outputs['legend']
             )
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def build_fig(
         _self,
-        abund,
+        tax_level,
+        filter_by,
+        abund_hash,
         sample_annots,
         color_by,
         title,
         metric,
-        nbins
+        nbins,
+        render_mode="Auto"
     ):
 
         # Mark the null comparison as a null value
@@ -314,7 +323,9 @@ class BetaDiversity(MicrobiomePlot):
 
         # Get the beta diversity data
         plot_df = _self.get_distances(
-            abund,
+            tax_level,
+            filter_by,
+            abund_hash,
             sample_annots,
             color_by,
             metric
@@ -336,9 +347,13 @@ class BetaDiversity(MicrobiomePlot):
         if color_by is not None:
 
             # If the value is numeric
-            if self._root()._is_numeric(plot_df[color_by]):
-                # Make a scatterplot
+            if _self._root()._is_numeric(plot_df[color_by]):
+                # Make a scatterplot, with one point per pair of samples
                 plot_f = px.scatter
+                plot_data["render_mode"] = _self.render_mode(
+                    plot_df.shape[0],
+                    render_mode
+                )
                 # With the x-axis as the metadata
                 plot_data["x"] = color_by
                 # Label the x axis
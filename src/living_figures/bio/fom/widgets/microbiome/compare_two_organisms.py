@@ -1,8 +1,9 @@
-import streamlit as st
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
 import widgets.streamlit as wist
 import pandas as pd
 import plotly.express as px
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
 
 
 class CompareTwoOrganisms(MicrobiomePlot):
@@ -16,6 +17,21 @@ class CompareTwoOrganisms(MicrobiomePlot):
         wist.StExpander(
             id="options",
             children=[
+                wist.StColumns(
+                    id="search",
+                    children=[
+                        wist.StString(
+                            id='org1_search',
+                            label="Search Organism 1",
+                            placeholder="Organism name"
+                        ),
+                        wist.StString(
+                            id='org2_search',
+                            label="Search Organism 2",
+                            placeholder="Organism name"
+                        )
+                    ]
+                ),
                 wist.StColumns(
                     id="row1",
                     children=[
@@ -67,6 +83,13 @@ class CompareTwoOrganisms(MicrobiomePlot):
                 ),
                 wist.StColumns(
                     id="row4",
+                    children=[
+                        MicrobiomePlot.render_mode_menu(),
+                        wist.StResource()
+                    ]
+                ),
+                wist.StColumns(
+                    id="row5",
                     children=[
                         wist.StString(id='title'),
                         wist.StTextArea(id='legend')
@@ -79,7 +102,8 @@ class CompareTwoOrganisms(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_abundance_data(
         _self,
         tax_level: str,
@@ -95,7 +119,8 @@ class CompareTwoOrganisms(MicrobiomePlot):
             filter=filter_by
         )
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def make_fig(
         _self,
         org1,
@@ -106,7 +131,8 @@ class CompareTwoOrganisms(MicrobiomePlot):
         height,
         title,
         abund_hash,
-        annot_hash
+        annot_hash,
+        render_mode="Auto"
     ):
 
         # Get the plotting data
@@ -153,7 +179,8 @@ class CompareTwoOrganisms(MicrobiomePlot):
                 _ABUND_2=org2.replace("_", " ")
             ),
             color=color_by if color_by != 'None' else None,
-            hover_name="index"
+            hover_name="index",
+            render_mode=_self.render_mode(plot_df.shape[0], render_mode)
         )
 
         # If there is a title
@@ -185,7 +212,8 @@ class CompareTwoOrganisms(MicrobiomePlot):
 
         return rank_abund.loc[name]
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_plotting_data(
         _self,
         org1,
@@ -230,7 +258,7 @@ class CompareTwoOrganisms(MicrobiomePlot):
             _ABUND_2=org2_abund
         )
 
-    def run_self(self):
+    def compute(self) -> dict:
 
         # Get all of the ploting parameters
         params = self.all_values(flatten=True)
@@ -238,7 +266,7 @@ class CompareTwoOrganisms(MicrobiomePlot):
         # If no organism is selected, take no action
         for kw in ['org1', 'org2']:
             if params[kw] is None or params[kw] == 'None':
-                return
+                return dict(fig=None, legend=None)
 
         # Get the figure to plot
         fig = self.make_fig(
@@ -251,22 +279,27 @@ class CompareTwoOrganisms(MicrobiomePlot):
             params['title'],
             self._root().abund_hash(),
             self._root().annot_hash(),
+            params['render_mode']
         )
 
+        return dict(fig=fig, legend=params['legend'])
+
+    def render(self, outputs: dict) -> None:
+
         # If there is a figure
-        if fig is not None:
+        if outputs['fig'] is not None:
 
             # Display it in the 'plot' child resource
             plot_area = self._get_child("plot")
             plot_area.main_empty.plotly_chart(
-                fig,
+                outputs['fig'],
                 use_container_width=True
             )
 
         # If there is a legend
-        if params['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                params['legend']
+                outputs['legend']
             )
@@ -1,12 +1,13 @@
 import numpy as np
 from scipy.stats import spearmanr, f_oneway
 from statsmodels.stats.multitest import multipletests
-import streamlit as st
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
 from living_figures.helpers.constants import tax_levels
 import widgets.streamlit as wist
 import pandas as pd
 import plotly.express as px
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
 
 
 class DifferentialAbundance(MicrobiomePlot):
@@ -50,6 +51,13 @@ class DifferentialAbundance(MicrobiomePlot):
                             id="max_p",
                             label="Threshold p-value",
                             value=0.05
+                        ),
+                        wist.StSelectString(
+                            id="transform",
+                            label="Transform",
+                            options=["None", "CLR", "ALR"],
+                            value="None",
+                            help="Log-ratio transform of the abundances, after replacing zeros" # noqa
                         )
                     ]
                 ),
@@ -80,7 +88,7 @@ class DifferentialAbundance(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    def run_self(self):
+    def compute(self) -> dict:
 
         # Get all of the ploting parameters
         kwargs = self.all_values(flatten=True)
@@ -103,8 +111,7 @@ class DifferentialAbundance(MicrobiomePlot):
             msg = "Please select a comparison to proceed"
 
         if msg is not None:
-            self.option("plot").main_empty.write(msg)
-            return
+            return dict(fig=None, msg=None, prompt=msg)
 
         # Make the figure
         fig, msg = self.make_fig(
@@ -117,21 +124,31 @@ class DifferentialAbundance(MicrobiomePlot):
             }
         )
 
+        return dict(fig=fig, msg=msg, prompt=None, legend=kwargs['legend'])
+
+    def render(self, outputs: dict) -> None:
+
+        # Prompt the user for any missing inputs
+        if outputs['prompt'] is not None:
+            self.option("plot").main_empty.write(outputs['prompt'])
+            return
+
         # Show the message
-        if msg is not None:
-            self.option("plot_msg").main_empty.write(msg)
+        if outputs['msg'] is not None:
+            self.option("plot_msg").main_empty.write(outputs['msg'])
 
         # Show the plot
-        if fig is not None:
-            self.option("plot").main_empty.plotly_chart(fig)
+        if outputs['fig'] is not None:
+            self.option("plot").main_empty.plotly_chart(outputs['fig'])
 
         # Show the legend
-        if kwargs['legend'] is not None and len(kwargs['legend']) > 0:
+        if outputs['legend'] is not None and len(outputs['legend']) > 0:
             self.option("legend_display").main_empty.write(
-                kwargs['legend']
+                outputs['legend']
             )
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def make_fig(_self, **kwargs):
         """Make the primary figure for plotting."""
 
@@ -158,13 +175,29 @@ class DifferentialAbundance(MicrobiomePlot):
         if meta.shape[0] < 3:
             return None, f"Not enough samples with data for: {color_by}"
 
+        # Test the (optionally log-ratio transformed) abundances
+        transform = kwargs.get("transform", "None")
+        test_abund = _self._root().transformed(
+            kwargs["tax_level"],
+            kwargs["filter_by"],
+            transform
+        )
+
         # Get the differential abundance table
         da_df, msg = _self.calc_diff_abund(
-            abund.reindex(columns=meta.index),
+            test_abund.reindex(columns=meta.index),
             meta,
-            continuous=self._root()._is_numeric(annot_df[color_by])
+            continuous=_self._root()._is_numeric(annot_df[color_by])
         )
 
+        # Always show the mean relative abundance of each organism
+        if transform is not None and transform != "None":
+            mean_abund = abund.reindex(columns=meta.index).mean(axis=1)
+            da_df = da_df.assign(**{
+                "Mean Abundance": da_df["Organism"].map(mean_abund)
+            })
+            msg = f"{msg} ({transform}-transformed abundances)"
+
         fig = px.scatter(
             data_frame=da_df,
             x="Mean Abundance",
@@ -192,7 +225,8 @@ class DifferentialAbundance(MicrobiomePlot):
 
         return fig, msg
 
-    @st.cache_data(max_entries=10)
+    @timed("statistics")
+    @cache_data(max_entries=10)
     def calc_diff_abund(
         _self,
         abund: pd.DataFrame,
@@ -2,9 +2,9 @@ from hashlib import md5
 from typing import Union
 import widgets.streamlit as wist
 import pandas as pd
-import streamlit as st
 from widgets.base.helpers import parse_dataframe_string
 from living_figures.bio.fom.utilities import parse_taxon_abundances
+from living_figures.helpers.registry import content_hash, shared_datasets
 
 
 class MicrobiomeAbund(wist.StDataFrame):
@@ -60,19 +60,24 @@ class MicrobiomeAbund(wist.StDataFrame):
             compression="gzip" if uploaded_file.name.endswith(".gz") else None
         )
 
-        # Parse the table of taxonomic abundances
-        self.value, self.index_orgs = self.parse_taxon_abundances(df)
-
-        # Compute the hash of the data
-        self.hash = md5(self.value.to_csv().encode()).hexdigest()
+        # Parse the table of taxonomic abundances, sharing the result
+        # with any other session which has uploaded the same data
+        self.value, self.index_orgs, self.hash = shared_datasets.get(
+            ("parse_taxon_abundances", content_hash(df)),
+            lambda: self.parse_taxon_abundances(df)
+        )
 
         shape = self.value.shape
         msg = f"Read {shape[0]:,} organisms and {shape[1]:,} samples"
         self._root().msg(msg)
 
-    @st.cache_data(max_entries=10)
-    def parse_taxon_abundances(_self, df):
-        return parse_taxon_abundances(df)
+    def parse_taxon_abundances(self, df):
+        """Parse the abundances, along with the hash of the parsed table."""
+
+        value, index_orgs = parse_taxon_abundances(df)
+
+        # Compute the hash of the data
+        return value, index_orgs, md5(value.to_csv().encode()).hexdigest()
 
 
 class StHashedDataFrame(wist.StDataFrame):
@@ -8,11 +8,13 @@ from living_figures.bio.fom.widgets.microbiome import BetaDiversity
 from living_figures.bio.fom.widgets.microbiome import DifferentialAbundance
 from living_figures.bio.fom.widgets.microbiome import SingleOrganism
 from living_figures.bio.fom.widgets.microbiome import CompareTwoOrganisms
+from living_figures.bio.fom.widgets.microbiome import TaxonomyTree
 from living_figures.bio.fom.widgets.microbiome.base_widget import BaseMicrobiomeExplorer # noqa
 from living_figures.helpers.parse_numeric import is_numeric
 from living_figures.helpers import parse_numeric
-import streamlit as st
 import widgets.streamlit as wist
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.tracing import traced
 
 
 class MicrobiomeExplorer(BaseMicrobiomeExplorer):
@@ -28,6 +30,7 @@ class MicrobiomeExplorer(BaseMicrobiomeExplorer):
         - Ordination of samples
         - Visualization of microbial abundances (stacked bars, etc.)
         - Comparison of the abundance of a single microbe across samples
+        - Mean abundance across the taxonomy (sunburst or icicle)
         - Testing for significant differences in organism abundances
           between groups of samples
     """
@@ -71,12 +74,13 @@ class MicrobiomeExplorer(BaseMicrobiomeExplorer):
                         BetaDiversity(id="beta_diversity"),
                         DifferentialAbundance(id="differential_abundance"),
                         SingleOrganism(id="single_organism"),
-                        CompareTwoOrganisms(id="compare_two_organisms")
+                        CompareTwoOrganisms(id="compare_two_organisms"),
+                        TaxonomyTree(id="taxonomy_tree")
                     ]
                 ))
-                for i in range(7)
+                for i in range(8)
             ],
-            value=[True for _ in range(7)]
+            value=[True for _ in range(8)]
         )
     ]
 
@@ -86,32 +90,59 @@ class MicrobiomeExplorer(BaseMicrobiomeExplorer):
     pyodide_requirements = ["statsmodels"]
 
     extra_imports = [
-        "from scipy.spatial import distance",
+        "from scipy.sparse.linalg import eigsh",
         "from scipy import stats",
         "from scipy.stats import entropy, spearmanr, pearsonr, f_oneway",
         "from living_figures.helpers import parse_numeric, is_numeric",
+        "from living_figures.helpers.concurrency import run_in_background, thread_map", # noqa
+        "from living_figures.helpers.caching import cache_data, cache_stats",
+        "from living_figures.helpers.memory import memory_governor",
+        "from living_figures.helpers.diagnostics import record_timings, timed",
+        "from living_figures.helpers.tracing import span, traced, tracer",
+        "from living_figures.helpers.registry import content_hash, current_session, shared_datasets", # noqa
+        "from living_figures.helpers.search import SearchIndex",
+        "from living_figures.helpers.distances import CondensedDistances",
+        "from living_figures.helpers.distances import pairwise_distances",
         "from statsmodels.stats.multitest import multipletests",
+        "import threading",
+        "import streamlit as st",
         "import numpy as np",
         "import pandas as pd",
         "from plotly.subplots import make_subplots",
         "import plotly.express as px",
         "import plotly.graph_objects as go",
-        "from typing import Union, Any, List",
+        "from typing import Union, Any, List, Tuple",
         "from widgets.base.exceptions import WidgetFunctionException",
         "from widgets.base.helpers import parse_dataframe_string",
         "from living_figures.helpers.scaling import convert_text_to_scalar",
+        "from living_figures.helpers.constants import tax_levels",
         "from living_figures.helpers.sorting import sort_table",
         "from living_figures.bio.fom.utilities import parse_taxon_abundances",
-        "from living_figures.bio.fom.widgets.microbiome.base_widget import BaseMicrobiomeExplorer", # noqa
+        "from living_figures.bio.fom.utilities import nmds",
+        "from living_figures.bio.fom.utilities import streaming_pca",
+        "from living_figures.bio.fom.utilities import alr, alr_reference, clr",
+        "from living_figures.bio.fom.utilities import log_proportions",
+        "from living_figures.bio.fom.widgets.microbiome.base_widget import BaseMicrobiomeExplorer, warm_up_lock, warmed_up", # noqa
         "from hashlib import md5",
         "from sklearn.decomposition import PCA",
         "from sklearn.manifold import TSNE"
     ]
 
+    @traced(cat="widget")
     def run_self(self):
 
+        # Optionally precompute the default plots in the background,
+        # once both of the inputs have been read
+        self.warm_up()
+
         self.update_options()
 
+        # Display the plots, if they are being computed concurrently
+        self.run_plots()
+
+        # Show the time spent on each plot, if enabled
+        self.show_diagnostics()
+
         self.clone_button(sidebar=True)
 
         # Link to the online documentation
@@ -120,11 +151,11 @@ class MicrobiomeExplorer(BaseMicrobiomeExplorer):
             f"[Microbiome Explorer Documentation]({docs_url})"
         )
 
-    @st.cache_data
+    @cache_data
     def _is_numeric(_self, cvals):
         return is_numeric(cvals)
 
-    @st.cache_data
+    @cache_data
     def _parse_numeric(_self, annots):
         return parse_numeric(annots)
 
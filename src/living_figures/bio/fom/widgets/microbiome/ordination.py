@@ -1,19 +1,26 @@
-from typing import Union
+from typing import Tuple, Union
 import widgets.streamlit as wist
 from widgets.base.exceptions import WidgetFunctionException
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from scipy.sparse.linalg import eigsh
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
-import streamlit as st
+from living_figures.bio.fom.utilities import nmds
+from living_figures.bio.fom.utilities import streaming_pca
 from living_figures.helpers.constants import tax_levels
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.concurrency import thread_map
+from living_figures.helpers.diagnostics import timed
+from living_figures.helpers.registry import shared_datasets
 
 
 class Ordination(MicrobiomePlot):
 
-    label = "Ordination (PCA/t-SNE)"
+    label = "Ordination (PCA/PCoA/NMDS/t-SNE)"
 
     children = [
         wist.StExpander(
@@ -25,7 +32,7 @@ class Ordination(MicrobiomePlot):
                         wist.StSelectString(
                             id='ord_type',
                             label="Ordination Type",
-                            options=['PCA', 't-SNE'],
+                            options=['PCA', 'PCoA', 'NMDS', 't-SNE'],
                             value='PCA'
                         ),
                         wist.StSelectString(
@@ -33,6 +40,13 @@ class Ordination(MicrobiomePlot):
                             label="Taxonomic Level",
                             options=tax_levels,
                             value="class"
+                        ),
+                        wist.StSelectString(
+                            id="transform",
+                            label="Transform (PCA/t-SNE)",
+                            options=["None", "CLR", "ALR"],
+                            value="None",
+                            help="Log-ratio transform of the abundances, after replacing zeros" # noqa
                         )
                     ]
                 ),
@@ -50,6 +64,12 @@ class Ordination(MicrobiomePlot):
                             label="Color Samples By",
                             options=[],
                             value=None
+                        ),
+                        wist.StCheckbox(
+                            id="refit",
+                            label="Refit to Filtered Samples",
+                            value=False,
+                            help="By default, filtered samples are shown on the axes fit to all samples" # noqa
                         )
                     ]
                 ),
@@ -65,11 +85,42 @@ class Ordination(MicrobiomePlot):
                             id='3D',
                             label="3D Plot",
                             value=False
+                        ),
+                        wist.StSelectString(
+                            id='metric',
+                            label="Distance Metric (PCoA/NMDS)",
+                            options=[
+                                'Bray-Curtis',
+                                'Euclidean',
+                                'Jensen-Shannon',
+                                'Aitchison'
+                            ],
+                            value='Bray-Curtis'
                         )
                     ]
                 ),
                 wist.StColumns(
                     id="row4",
+                    children=[
+                        MicrobiomePlot.render_mode_menu(),
+                        wist.StString(
+                            id="perplexity",
+                            label="t-SNE Perplexity",
+                            value="30",
+                            help="Separate values with commas to compare them side by side (2D only)" # noqa
+                        ),
+                        wist.StInteger(
+                            id="nmds_starts",
+                            label="NMDS Random Starts",
+                            min_value=1,
+                            max_value=64,
+                            value=4,
+                            help="The solution with the lowest stress is shown"
+                        )
+                    ]
+                ),
+                wist.StColumns(
+                    id="row5",
                     children=[
                         wist.StString(id='title'),
                         wist.StTextArea(id='legend')
@@ -82,16 +133,26 @@ class Ordination(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("statistics")
+    @cache_data(max_entries=10)
     def run_ordination(
         _self,
         tax_level,
         filter_by,
         ord_type,
         abund: pd.DataFrame,
-        is_3d: bool
+        is_3d: bool,
+        perplexity="30",
+        metric="Bray-Curtis",
+        nmds_starts=4,
+        refit=False,
+        transform="None"
     ) -> Union[None, pd.DataFrame]:
-        """Perform ordination on the abundance data."""
+        """
+        Perform ordination on the abundance data. Unless refit is True,
+        the ordination is fit once to all of the samples at each level,
+        and any filter selects samples from those coordinates.
+        """
 
         # If there are no abundances
         if abund is None:
@@ -103,29 +164,118 @@ class Ordination(MicrobiomePlot):
         msg = f"Running {ord_type} on {abund.shape[1]:,} samples"
         msg = f"{msg} using {abund.shape[0]:,}"
         msg = f"{msg} {tax_level}-level organisms"
-        if filter_by is not None and filter_by != 'None':
+        is_filtered = filter_by is not None and filter_by != 'None'
+        if is_filtered:
             msg = msg + "  \n" + f"Filtering to {filter_by}"
 
+        # The samples which the ordination is fit to
+        fit_filter = filter_by if is_filtered and refit else 'None'
+
+        ord_msg = ""
+
         if ord_type == 'PCA':
-            proj, loadings = _self.run_pca(abund)
+            proj, loadings = _self.pca(
+                tax_level,
+                fit_filter,
+                transform=transform
+            )
+        elif ord_type == 'PCoA':
+            proj, loadings = _self.pcoa(tax_level, fit_filter, metric), None
+        elif ord_type == 'NMDS':
+            proj, stress = _self.nmds(
+                tax_level,
+                fit_filter,
+                metric,
+                is_3d,
+                nmds_starts
+            )
+            loadings = None
+            ord_msg = f"NMDS stress: {stress:.3f}"
         elif ord_type == 't-SNE':
-            proj, loadings = _self.run_tsne(abund, is_3d)
+            proj, loadings = _self.tsne_sweep(
+                tax_level,
+                fit_filter,
+                is_3d,
+                perplexity,
+                transform
+            ), None
         else:
             msg = "Ordination type not recognized"
             raise WidgetFunctionException(msg)
 
-        return proj, loadings, ""
+        # Show the filtered samples on the axes fit to all samples
+        if is_filtered and not refit:
+            n_fit = proj.index.nunique()
+            proj = proj.loc[proj.index.isin(abund.columns)]
+            fit_msg = f"Axes fit to all {n_fit:,} samples"
+            ord_msg = fit_msg if ord_msg == "" else f"{ord_msg}  \n{fit_msg}"
 
-    def run_pca(self, abund: pd.DataFrame):
-        """Ordinate data using PCA"""
+        return proj, loadings, ord_msg
+
+    def pca(
+        self,
+        tax_level,
+        filter_by,
+        n_components=3,
+        transform="None"
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Return the coordinates and loadings of the first n PCs,
+        which are shared by the 2D and 3D plots (and every session)
+        for each set of (optionally log-ratio transformed) abundances.
+        """
+
+        root = self._root()
+        if filter_by is None or filter_by == 'None':
+            annot_hash = None
+        else:
+            annot_hash = root.annot_hash()
+
+        return shared_datasets.get(
+            (
+                "pca",
+                root.abund_hash(),
+                annot_hash,
+                tax_level,
+                filter_by,
+                n_components,
+                transform
+            ),
+            lambda: self.run_pca(
+                root.transformed(tax_level, filter_by, transform),
+                n_components=n_components,
+                batch_size=root.pca_batch_size
+            )
+        )
 
-        pca = PCA()
-        ord_mat = pca.fit_transform(abund.T)
+    def run_pca(self, abund: pd.DataFrame, n_components=3, batch_size=None):
+        """
+        Ordinate data using PCA, computing only the components which are
+        plotted with a randomized (dense) or truncated (sparse) SVD.
+        Tables with more than batch_size samples are read in batches
+        (from the shared abundance table at this level) rather than
+        being transposed in memory.
+        """
+
+        # There cannot be more components than organisms or samples
+        n_components = min(n_components, abund.shape[0], abund.shape[1])
+
+        if batch_size is not None and abund.shape[1] > batch_size:
+            ord_mat, components, explained_variance_ratio = streaming_pca(
+                abund,
+                n_components=n_components,
+                batch_size=batch_size
+            )
+        else:
+            ord_mat, components, explained_variance_ratio = self._fit_pca(
+                abund,
+                n_components
+            )
 
         # Name each PC for the amount of variance it explains
         pc_names = [
             f"PC{i+1} ({round(v * 100, 1)}%)"
-            for i, v in enumerate(pca.explained_variance_ratio_)
+            for i, v in enumerate(explained_variance_ratio)
         ]
 
         # Projection of the samples in the ordination space
@@ -140,21 +290,306 @@ class Ordination(MicrobiomePlot):
 
         # Loadings of each variable for each axis
         loadings = pd.DataFrame(
-            pca.components_,
+            components,
             index=pc_names,
             columns=abund.index.values
         )
 
         return coords, loadings
 
-    def run_tsne(self, abund: pd.DataFrame, is_3d: bool):
-        """Ordinate data using t-SNE"""
+    def _fit_pca(self, abund: pd.DataFrame, n_components: int):
+        """Fit PCA with every sample in memory."""
+
+        # Tables with sparse columns are not converted to dense arrays
+        is_sparse = abund.shape[0] > 0 and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in abund.dtypes
+        )
+
+        # The full SVD is only used for small tables (where it is fast
+        # and exact), or if all of the components are needed
+        if max(abund.shape) <= 500 or n_components == min(abund.shape):
+            svd_solver = "full"
+        elif is_sparse:
+            svd_solver = "arpack"
+        else:
+            svd_solver = "randomized"
+
+        if svd_solver == "arpack":
+            mat = abund.sparse.to_coo().T.tocsr()
+        elif is_sparse:
+            mat = abund.sparse.to_dense().T.values
+        else:
+            mat = abund.T.values
+
+        pca = PCA(
+            n_components=n_components,
+            svd_solver=svd_solver,
+            random_state=0
+        )
+        ord_mat = pca.fit_transform(mat)
+
+        return ord_mat, pca.components_, pca.explained_variance_ratio_
+
+    def pcoa(self, tax_level, filter_by, metric) -> pd.DataFrame:
+        """
+        Return the coordinates of the first three principal coordinates,
+        which are shared by the 2D and 3D plots (and every session).
+        The distance matrix is shared with the Beta Diversity plot.
+        """
+
+        root = self._root()
+        if filter_by is None or filter_by == 'None':
+            annot_hash = None
+        else:
+            annot_hash = root.annot_hash()
+
+        return shared_datasets.get(
+            (
+                "pcoa",
+                root.abund_hash(),
+                annot_hash,
+                tax_level,
+                filter_by,
+                metric
+            ),
+            lambda: self.run_pcoa(
+                root.distances(tax_level, filter_by, metric).square()
+            )
+        )
+
+    def run_pcoa(self, dm: pd.DataFrame, n_components=3) -> pd.DataFrame:
+        """
+        Ordinate a distance matrix using Principal Coordinates Analysis,
+        computing only the leading axes with a truncated eigensolver
+        (except for small matrices, which are decomposed exactly).
+        """
+
+        n_samples = dm.shape[0]
+        n_components = min(n_components, n_samples - 1)
+
+        # Double-center the matrix of squared distances
+        sq_dists = dm.values.astype(np.float64) ** 2
+        centered = -0.5 * (
+            sq_dists
+            - sq_dists.mean(axis=0)
+            - sq_dists.mean(axis=1)[:, None]
+            + sq_dists.mean()
+        )
+
+        if n_samples > 500:
+            eigvals, eigvecs = eigsh(centered, k=n_components, which="LA")
+        else:
+            eigvals, eigvecs = np.linalg.eigh(centered)
+
+        # Keep the largest eigenvalues, in descending order
+        order = np.argsort(eigvals)[::-1][:n_components]
+        eigvals, eigvecs = eigvals[order], eigvecs[:, order]
+
+        coords = eigvecs * np.sqrt(np.clip(eigvals, 0, None))
+
+        # The trace is the sum of every eigenvalue (the total variation)
+        total = np.trace(centered)
+
+        return pd.DataFrame(
+            coords,
+            columns=[
+                f"PCo{i+1} ({round(v / total * 100, 1)}%)"
+                for i, v in enumerate(eigvals)
+            ],
+            index=dm.index
+        )
+
+    def nmds(
+        self,
+        tax_level,
+        filter_by,
+        metric,
+        is_3d,
+        n_starts
+    ) -> Tuple[pd.DataFrame, float]:
+        """
+        Return the NMDS coordinates of each sample and the stress,
+        which are cached for each distance matrix (shared with PCoA
+        and Beta Diversity) and number of dimensions and starts.
+        """
+
+        root = self._root()
+        if filter_by is None or filter_by == 'None':
+            annot_hash = None
+        else:
+            annot_hash = root.annot_hash()
+
+        return shared_datasets.get(
+            (
+                "nmds",
+                root.abund_hash(),
+                annot_hash,
+                tax_level,
+                filter_by,
+                metric,
+                is_3d,
+                n_starts
+            ),
+            lambda: self.run_nmds(
+                root.distances(tax_level, filter_by, metric).square(),
+                is_3d,
+                n_starts
+            )
+        )
+
+    def run_nmds(
+        self,
+        dm: pd.DataFrame,
+        is_3d: bool,
+        n_starts=4
+    ) -> Tuple[pd.DataFrame, float]:
+        """
+        Ordinate a distance matrix using non-metric multidimensional
+        scaling, running each random start in a pool of processes.
+        """
+
+        coords, stress = nmds(
+            dm.values,
+            n_components=3 if is_3d else 2,
+            n_starts=n_starts
+        )
+
+        return pd.DataFrame(
+            coords,
+            columns=[f"NMDS{i+1}" for i in range(coords.shape[1])],
+            index=dm.index
+        ), stress
+
+    def tsne_sweep(
+        self,
+        tax_level,
+        filter_by,
+        is_3d,
+        perplexity: str,
+        transform="None"
+    ):
+        """
+        Run t-SNE for each of the comma-separated perplexity values
+        in parallel, adding a perplexity column if there is more than one.
+        The worker threads of the explorer are divided between the values.
+        """
+
+        try:
+            values = [float(val) for val in str(perplexity).split(",")]
+        except ValueError:
+            msg = f"Perplexity must be a number, not {perplexity}"
+            raise WidgetFunctionException(msg)
+
+        # Only a single value can be shown in 3D
+        if is_3d:
+            values = values[:1]
+
+        max_workers = max(self._root().max_workers or 1, 1)
+        n_threads = min(len(values), max_workers)
+        n_jobs = max(max_workers // n_threads, 1)
+
+        coords = thread_map(
+            lambda val: self.tsne(
+                tax_level,
+                filter_by,
+                is_3d,
+                val,
+                transform,
+                n_jobs=n_jobs
+            ),
+            values,
+            max_workers=n_threads
+        )
+
+        if len(coords) == 1:
+            return coords[0]
+
+        return pd.concat([
+            val_coords.assign(perplexity=val)
+            for val, val_coords in zip(values, coords)
+        ])
+
+    def tsne(
+        self,
+        tax_level,
+        filter_by,
+        is_3d,
+        perplexity,
+        transform="None",
+        n_jobs=1
+    ) -> pd.DataFrame:
+        """
+        Return the t-SNE coordinates of every sample, which are shared
+        by every session. The samples are first reduced to their leading
+        PCs (which are shared by the 2D and 3D plots).
+        The fit uses n_jobs threads (which do not change the result).
+        """
+
+        root = self._root()
+        if filter_by is None or filter_by == 'None':
+            annot_hash = None
+        else:
+            annot_hash = root.annot_hash()
+
+        return shared_datasets.get(
+            (
+                "tsne",
+                root.abund_hash(),
+                annot_hash,
+                tax_level,
+                filter_by,
+                is_3d,
+                perplexity,
+                transform
+            ),
+            lambda: self.run_tsne(
+                self.pca(
+                    tax_level,
+                    filter_by,
+                    n_components=50,
+                    transform=transform
+                )[0],
+                is_3d,
+                perplexity,
+                n_jobs=n_jobs
+            )
+        )
+
+    def run_tsne(
+        self,
+        coords: pd.DataFrame,
+        is_3d: bool,
+        perplexity=30.,
+        max_exact=500,
+        n_jobs=1
+    ):
+        """
+        Ordinate data using t-SNE, starting from the PCA coordinates
+        of each sample. The exact gradient is used for up to max_exact
+        samples, and the Barnes-Hut approximation for larger datasets.
+        """
+
+        n_components = 3 if is_3d else 2
+        n_samples = coords.shape[0]
+
+        # Start from the leading PCs, scaled as for init="pca"
+        init = coords.values[:, :n_components]
+        if init.shape[1] == n_components and np.std(init[:, 0]) > 0:
+            init = init / np.std(init[:, 0]) * 1e-4
+        else:
+            init = "random"
 
         tsne = TSNE(
-            n_components=3 if is_3d else 2
+            n_components=n_components,
+            perplexity=min(perplexity, n_samples - 1),
+            init=init,
+            method="exact" if n_samples <= max_exact else "barnes_hut",
+            random_state=0,
+            n_jobs=n_jobs
         )
-        ord_mat = tsne.fit_transform(abund.T)
-        coords = pd.DataFrame(
+        ord_mat = tsne.fit_transform(coords.values)
+
+        return pd.DataFrame(
             ord_mat,
             columns=[
                 f"t-SNE {i+1}"
@@ -162,13 +597,11 @@ class Ordination(MicrobiomePlot):
             ],
             index=[
                 org.split(";")[-1]
-                for org in abund.columns
+                for org in coords.index
             ]
         )
 
-        return coords, None
-
-    def run_self(self) -> None:
+    def compute(self) -> dict:
 
         # Get all of the plotting parameters
         params = self.all_values(flatten=True)
@@ -193,25 +626,37 @@ class Ordination(MicrobiomePlot):
             params["color_by"],
             params["title"],
             params["pca_loadings"],
+            params["render_mode"],
+            params["perplexity"],
+            params["metric"],
+            params["nmds_starts"],
+            params["refit"],
+            params["transform"]
         )
 
+        return dict(fig=fig, msg=msg, legend=params["legend"])
+
+    def render(self, outputs: dict) -> None:
+
+        msg = outputs["msg"]
         if msg is not None and len(msg) > 0:
             self._get_child("ord_msg").main_empty.write(msg)
-        if fig is None:
+        if outputs["fig"] is None:
             return
 
         # Add the plot to the display
-        self._get_child("plot").main_empty.plotly_chart(fig)
+        self._get_child("plot").main_empty.plotly_chart(outputs["fig"])
 
         # If there is a legend
-        if params['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                params['legend']
+                outputs['legend']
             )
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def build_fig(
         _self,
         tax_level,
@@ -222,7 +667,13 @@ class Ordination(MicrobiomePlot):
         is_3d,
         color_by,
         title,
-        pca_loadings
+        pca_loadings,
+        render_mode="Auto",
+        perplexity="30",
+        metric="Bray-Curtis",
+        nmds_starts=4,
+        refit=False,
+        transform="None"
     ):
 
         # Get the ordinated data
@@ -231,12 +682,21 @@ class Ordination(MicrobiomePlot):
             filter_by,
             ord_type,
             abund,
-            is_3d
+            is_3d,
+            perplexity,
+            metric,
+            nmds_starts,
+            refit,
+            transform
         )
 
         if plot_df is None:
             return None, msg
 
+        # The coordinates are sent to the browser as binary arrays,
+        # which do not need more than single precision
+        plot_df = plot_df.astype(np.float32)
+
         # Add the metadata (if any was provided)
         if sample_annots is not None:
             plot_df = plot_df.merge(
@@ -257,6 +717,8 @@ class Ordination(MicrobiomePlot):
             ),
             x=plot_df.columns.values[0],
             y=plot_df.columns.values[1],
+            # The value used for the color is also shown in the
+            # mouseover text, and does not need to be added again
             hover_data=[
                 plot_df.columns.values[0],
                 plot_df.columns.values[1],
@@ -264,8 +726,6 @@ class Ordination(MicrobiomePlot):
             ],
             color=color_by
         )
-        if color_by is not None:
-            plot_kwargs["hover_data"].append(color_by)
 
         # If the 3D plot was requested
         if is_3d:
@@ -276,6 +736,15 @@ class Ordination(MicrobiomePlot):
             )
         else:
             plot_f = px.scatter
+            plot_kwargs['render_mode'] = _self.render_mode(
+                plot_df.shape[0],
+                render_mode
+            )
+
+            # Each value in a t-SNE perplexity sweep is shown side by side
+            if "perplexity" in plot_df.columns.values:
+                plot_kwargs['facet_col'] = "perplexity"
+                plot_kwargs['facet_col_wrap'] = 3
 
         # Make a plot
         fig = plot_f(**plot_kwargs)
@@ -1,8 +1,9 @@
-import streamlit as st
 from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
 import widgets.streamlit as wist
 import pandas as pd
 import plotly.express as px
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
 
 
 class SingleOrganism(MicrobiomePlot):
@@ -16,6 +17,16 @@ class SingleOrganism(MicrobiomePlot):
         wist.StExpander(
             id="options",
             children=[
+                wist.StColumns(
+                    id="search",
+                    children=[
+                        wist.StString(
+                            id='org_search',
+                            label="Search Organisms",
+                            placeholder="Organism name"
+                        )
+                    ]
+                ),
                 wist.StColumns(
                     id="row1",
                     children=[
@@ -67,6 +78,13 @@ class SingleOrganism(MicrobiomePlot):
                 ),
                 wist.StColumns(
                     id="row4",
+                    children=[
+                        MicrobiomePlot.render_mode_menu(),
+                        wist.StResource()
+                    ]
+                ),
+                wist.StColumns(
+                    id="row5",
                     children=[
                         wist.StString(id='title'),
                         wist.StTextArea(id='legend')
@@ -79,7 +97,8 @@ class SingleOrganism(MicrobiomePlot):
         wist.StResource(id="legend_display")
     ]
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_abundance_data(
         _self,
         tax_level: str,
@@ -95,7 +114,8 @@ class SingleOrganism(MicrobiomePlot):
             filter=filter_by
         )
 
-    @st.cache_data(max_entries=10)
+    @timed("figure")
+    @cache_data(max_entries=10)
     def make_fig(
         _self,
         org,
@@ -106,7 +126,8 @@ class SingleOrganism(MicrobiomePlot):
         height,
         title,
         abund_hash,
-        annot_hash
+        annot_hash,
+        render_mode="Auto"
     ):
 
         if color_by is None or color_by == 'None':
@@ -141,11 +162,17 @@ class SingleOrganism(MicrobiomePlot):
                 )
             )
 
+        plot_kwargs = dict()
+
         if plot_type == 'Box':
             plot_f = px.box
 
         elif plot_type == 'Scatter':
             plot_f = px.scatter
+            plot_kwargs["render_mode"] = _self.render_mode(
+                plot_df.shape[0],
+                render_mode
+            )
 
         else:
             assert False, f"Did not recognize plot type: {plot_type}"
@@ -156,7 +183,8 @@ class SingleOrganism(MicrobiomePlot):
             y='_ABUND',
             log_y=log,
             height=height,
-            labels=dict(_ABUND=org.replace("_", " "))
+            labels=dict(_ABUND=org.replace("_", " ")),
+            **plot_kwargs
         )
 
         # If there is a title
@@ -165,7 +193,8 @@ class SingleOrganism(MicrobiomePlot):
 
         return fig
 
-    @st.cache_data(max_entries=10)
+    @timed("data")
+    @cache_data(max_entries=10)
     def get_plotting_data(
         _self,
         org,
@@ -216,14 +245,14 @@ class SingleOrganism(MicrobiomePlot):
 
         return rank_abund.loc[name]
 
-    def run_self(self):
+    def compute(self) -> dict:
 
         # Get all of the ploting parameters
         params = self.all_values(flatten=True)
 
         # If no organism is selected, take no action
         if params['org'] is None or params['org'] == 'None':
-            return
+            return dict(fig=None, legend=None)
 
         # Get the figure to plot
         fig = self.make_fig(
@@ -236,22 +265,27 @@ class SingleOrganism(MicrobiomePlot):
             params['title'],
             self._root().abund_hash(),
             self._root().annot_hash(),
+            params['render_mode']
         )
 
+        return dict(fig=fig, legend=params['legend'])
+
+    def render(self, outputs: dict) -> None:
+
         # If there is a figure
-        if fig is not None:
+        if outputs['fig'] is not None:
 
             # Display it in the 'plot' child resource
             plot_area = self._get_child("plot")
             plot_area.main_empty.plotly_chart(
-                fig,
+                outputs['fig'],
                 use_container_width=True
             )
 
         # If there is a legend
-        if params['legend'] is not None:
+        if outputs['legend'] is not None:
             self._get_child(
                 "legend_display"
             ).main_empty.markdown(
-                params['legend']
+                outputs['legend']
             )
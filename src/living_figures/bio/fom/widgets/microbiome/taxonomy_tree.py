@@ -0,0 +1,289 @@
+from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
+import widgets.streamlit as wist
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from living_figures.helpers.caching import cache_data
+from living_figures.helpers.diagnostics import timed
+
+
+class TaxonomyTree(MicrobiomePlot):
+    """
+    Display the average abundance of every organism across all levels
+    of the taxonomy, with each node sized by its mean relative abundance.
+
+    Options:
+        - Display form:
+            * Sunburst
+            * Icicle
+        - Color by prevalence or lineage
+        - Filter samples
+        - Compare groups of samples (one chart per group)
+        - Maximum depth
+        - Minimum abundance
+        - Figure height
+        - Title
+        - Legend
+    """
+
+    label = "Taxonomic Tree"
+
+    children = [
+        wist.StExpander(
+            id="options",
+            children=[
+                wist.StColumns(
+                    id="row1",
+                    children=[
+                        wist.StSelectString(
+                            id="plot_type",
+                            label="Plot Type",
+                            options=["Sunburst", "Icicle"],
+                            value="Sunburst"
+                        ),
+                        wist.StSelectString(
+                            id="node_color",
+                            label="Color Nodes By",
+                            options=["Prevalence", "Lineage"],
+                            value="Prevalence"
+                        )
+                    ]
+                ),
+                wist.StColumns(
+                    id="row2",
+                    children=[
+                        wist.StSelectString(
+                            id="filter_by",
+                            label="Filter Samples",
+                            options=[],
+                            value=None
+                        ),
+                        wist.StSelectString(
+                            id="color_by",
+                            label="Compare Samples By",
+                            options=[]
+                        )
+                    ]
+                ),
+                wist.StColumns(
+                    id="row3",
+                    children=[
+                        wist.StInteger(
+                            id="max_depth",
+                            label="Maximum Depth",
+                            min_value=1,
+                            max_value=9,
+                            value=4
+                        ),
+                        wist.StFloat(
+                            id="min_abund",
+                            label="Minimum Abundance (%)",
+                            value=0.1,
+                            min_value=0.
+                        ),
+                        wist.StInteger(
+                            label="Figure Height",
+                            id="figure_height",
+                            min_value=100,
+                            max_value=1200,
+                            step=1,
+                            value=600
+                        )
+                    ]
+                ),
+                wist.StColumns(
+                    id="row4",
+                    children=[
+                        wist.StString(id='title'),
+                        wist.StTextArea(id='legend')
+                    ]
+                )
+            ]
+        ),
+        wist.StResource(id="plot"),
+        wist.StResource(id="plot_msg"),
+        wist.StResource(id="legend_display")
+    ]
+
+    def prune_nodes(
+        self,
+        nodes: pd.DataFrame,
+        max_depth: int,
+        min_abund: float
+    ) -> pd.DataFrame:
+        """
+        Remove the nodes below the maximum depth, and any nodes (along with
+        all of their descendants) below the minimum mean abundance.
+        """
+
+        nodes = nodes.loc[
+            (nodes["depth"] <= max_depth) & (nodes["mean"] >= min_abund)
+        ]
+
+        # Drop any nodes whose parent was removed, one level at a time
+        kept = []
+        for depth, depth_nodes in nodes.groupby("depth", sort=True):
+            if depth > 1:
+                parents = set(kept[-1]["id"].values)
+                depth_nodes = depth_nodes.loc[
+                    depth_nodes["parent"].isin(parents)
+                ]
+            kept.append(depth_nodes)
+
+        if len(kept) == 0:
+            return nodes
+
+        return pd.concat(kept)
+
+    @timed("figure")
+    @cache_data(max_entries=10)
+    def make_fig(
+        _self,
+        plot_type,
+        node_color,
+        filter_by,
+        color_by,
+        max_depth,
+        min_abund,
+        figure_height,
+        title,
+        abund_hash,
+        annot_hash
+    ):
+        """Make the figure to plot."""
+
+        # Summary of every node, computed once for each filter and grouping
+        nodes = _self._root().taxonomy_nodes(
+            filter=filter_by,
+            group_by=color_by
+        )
+
+        if nodes.shape[0] == 0:
+            return
+
+        groups = list(nodes["group"].drop_duplicates().values)
+
+        trace_type = go.Icicle if plot_type == "Icicle" else go.Sunburst
+
+        fig = go.Figure()
+
+        for ix, group in enumerate(groups):
+
+            # Only the nodes which pass the thresholds are sent to the browser
+            group_nodes = _self.prune_nodes(
+                nodes.loc[nodes["group"] == group],
+                max_depth,
+                min_abund
+            )
+
+            trace_kwargs = dict()
+            if node_color == "Prevalence":
+                trace_kwargs["marker"] = dict(
+                    colors=group_nodes["prevalence"].values.astype(np.float32),
+                    coloraxis="coloraxis"
+                )
+
+            fig.add_trace(
+                trace_type(
+                    ids=group_nodes["id"].values,
+                    parents=group_nodes["parent"].values,
+                    labels=group_nodes["label"].values,
+                    values=group_nodes["mean"].values.astype(np.float32),
+                    branchvalues="total",
+                    customdata=np.stack([
+                        group_nodes["level"].fillna("").values,
+                        group_nodes["prevalence"].round(1).values
+                    ], axis=-1),
+                    hovertemplate=(
+                        "%{label} (%{customdata[0]})<br>"
+                        "Mean Abundance: %{value:.4g}%<br>"
+                        "Prevalence: %{customdata[1]}%"
+                        f"<extra>{group}</extra>"
+                    ),
+                    name=group,
+                    domain=dict(
+                        x=[ix / len(groups), (ix + 1) / len(groups)],
+                        y=[0, 0.95 if len(groups) > 1 else 1]
+                    )
+                )
+            )
+
+            # Label each chart with the group of samples it shows
+            if len(groups) > 1:
+                n_samples = group_nodes["n_samples"].max()
+                fig.add_annotation(
+                    text=f"{group} (n={n_samples:,})",
+                    x=(ix + 0.5) / len(groups),
+                    y=1,
+                    xref="paper",
+                    yref="paper",
+                    showarrow=False
+                )
+
+        fig.update_layout(
+            height=figure_height,
+            margin=dict(t=40, l=0, r=0, b=0),
+            coloraxis=dict(
+                colorscale="blues",
+                cmin=0,
+                cmax=100,
+                colorbar_title="Prevalence<br>(%)"
+            )
+        )
+
+        # If there is a title
+        if title is not None and title != "None":
+            fig.update_layout(title=title)
+
+        return fig
+
+    def compute(self) -> dict:
+
+        # Get the plotting options
+        params = self.all_values(flatten=True)
+
+        # Each group of samples is shown in its own chart
+        color_by = params['color_by']
+        if color_by is not None and color_by != 'None':
+            profile = self._root().metadata_profile().set_index("name")
+            if profile.loc[color_by, "n_unique"] > 10:
+                msg = f"Too many values of {color_by} to compare samples"
+                return dict(fig=None, msg=msg, legend=params['legend'])
+
+        fig = self.make_fig(
+            params['plot_type'],
+            params['node_color'],
+            params['filter_by'],
+            color_by,
+            params['max_depth'],
+            params['min_abund'],
+            params['figure_height'],
+            params['title'],
+            self._root().abund_hash(),
+            self._root().annot_hash()
+        )
+
+        return dict(fig=fig, msg=None, legend=params['legend'])
+
+    def render(self, outputs: dict) -> None:
+
+        # If there is a figure
+        if outputs['fig'] is not None:
+
+            # Display it in the 'plot' child resource
+            self.option("plot").main_empty.plotly_chart(
+                outputs['fig'],
+                use_container_width=True
+            )
+
+        # Print any messages
+        if outputs['msg'] is not None:
+            self.option("plot_msg").main_empty.write(outputs['msg'])
+
+        # If there is a legend
+        if outputs['legend'] is not None:
+            self._get_child(
+                "legend_display"
+            ).main_empty.markdown(
+                outputs['legend']
+            )
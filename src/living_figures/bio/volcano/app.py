@@ -4,6 +4,7 @@ import numpy as np
 import plotly.express as px
 import widgets.streamlit as wist
 from widgets.base.exceptions import WidgetFunctionException
+from living_figures.helpers.tracing import traced
 
 
 class Volcano(wist.StreamlitWidget):
@@ -13,7 +14,8 @@ class Volcano(wist.StreamlitWidget):
         "import plotly.express as px",
         "import numpy as np",
         "from io import StringIO",
-        "from widgets.base.exceptions import WidgetFunctionException"
+        "from widgets.base.exceptions import WidgetFunctionException",
+        "from living_figures.helpers.tracing import traced"
     ]
 
     requirements = ["plotly", "kaleido"]
@@ -139,6 +141,7 @@ class Volcano(wist.StreamlitWidget):
         )
     ]
 
+    @traced(cat="widget")
     def run_self(self):
 
         # Set up the color map using the plotly express palettes
@@ -241,8 +244,9 @@ class Volcano(wist.StreamlitWidget):
             data_frame=df.assign(
                 # Apply the transformation and create a new column
                 **{
-                    pval["trans_cname"]: df[pval["cname"]].apply(
-                        lambda v: self.transform_pval(v, pval["trans"])
+                    pval["trans_cname"]: self.transform_pval(
+                        df[pval["cname"]],
+                        pval["trans"]
                     )
                 }
             ),
@@ -386,7 +390,9 @@ class Volcano(wist.StreamlitWidget):
                 self.selected_columns.append(cname)
                 return cname
 
-    def transform_pval(self, v: float, trans: str):
+    def transform_pval(self, v, trans: str):
+        """Apply the transformation to a p-value (or a column of p-values)."""
+
         if trans == "-log10":
             return -np.log10(v)
         elif trans == "":
@@ -2,3 +2,22 @@ from living_figures.helpers.parse_numeric import parse_numeric # noqa
 from living_figures.helpers.parse_numeric import is_numeric # noqa
 from living_figures.helpers.scaling import convert_text_to_scalar # noqa
 from living_figures.helpers.sorting import sort_table # noqa
+from living_figures.helpers.concurrency import thread_map # noqa
+from living_figures.helpers.concurrency import run_in_background # noqa
+from living_figures.helpers.concurrency import process_map # noqa
+from living_figures.helpers.caching import cache_data # noqa
+from living_figures.helpers.caching import cache_stats # noqa
+from living_figures.helpers.caching import set_cache_budget # noqa
+from living_figures.helpers.memory import memory_governor # noqa
+from living_figures.helpers.diagnostics import record_timings # noqa
+from living_figures.helpers.diagnostics import timed # noqa
+from living_figures.helpers.registry import content_hash # noqa
+from living_figures.helpers.registry import shared_datasets # noqa
+from living_figures.helpers.search import SearchIndex # noqa
+from living_figures.helpers.distances import CondensedDistances # noqa
+from living_figures.helpers.distances import pairwise_distances # noqa
+from living_figures.helpers.tracing import span # noqa
+from living_figures.helpers.tracing import traced # noqa
+from living_figures.helpers.tracing import enable_tracing # noqa
+from living_figures.helpers.tracing import disable_tracing # noqa
+from living_figures.helpers.tracing import export_trace # noqa
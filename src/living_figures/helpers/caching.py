@@ -0,0 +1,155 @@
+from collections import defaultdict
+from functools import wraps
+from hashlib import md5
+import inspect
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Union
+import pandas as pd
+from living_figures.helpers.memory import memory_governor
+from living_figures.helpers.registry import content_hash
+from living_figures.helpers.tracing import span
+
+# Number of calls and cache misses for each cached function
+_stats: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: dict(calls=0, misses=0)
+)
+_stats_lock = threading.Lock()
+
+# Serialized output of each cached function call
+_store: Dict[Hashable, bytes] = dict()
+
+
+def _count(name: str, kw: str):
+    with _stats_lock:
+        _stats[name][kw] += 1
+
+
+def _hash_args(signature: inspect.Signature, args, kwargs) -> str:
+    """
+    Hash the arguments of a function call.
+    As with st.cache_data, any arguments starting with an underscore
+    (e.g. _self) are not hashed.
+    """
+
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+
+    hasher = md5()
+    for name, value in bound.arguments.items():
+        if name.startswith("_"):
+            continue
+        hasher.update(name.encode())
+        try:
+            hasher.update(content_hash(value).encode())
+        except Exception:
+            hasher.update(repr(value).encode())
+
+    return hasher.hexdigest()
+
+
+def _evict(key: Hashable):
+    _store.pop(key, None)
+
+
+def cache_data(
+    func: Callable = None,
+    max_entries: Union[int, None] = None
+):
+    """
+    Cache the output of a function, keyed by the value of its arguments,
+    while keeping track of the number of cache hits and misses.
+    As with st.cache_data, the output is stored in serialized form and a
+    new copy is returned for each call, so it is safe to modify.
+    The size of every stored output is counted against the budget of the
+    memory governor, which evicts outputs across all cached functions.
+    The decorator can be used with or without arguments.
+    """
+
+    if func is None:
+        return lambda f: cache_data(f, max_entries=max_entries)
+
+    name = func.__qualname__
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kw):
+        _count(name, "calls")
+
+        key = (name, _hash_args(signature, args, kw))
+
+        data = _store.get(key)
+        if data is not None:
+            memory_governor.touch(key)
+            return pickle.loads(data)
+
+        _count(name, "misses")
+
+        start = time.perf_counter()
+        with span("cache miss", cat="cache", function=name):
+            value = func(*args, **kw)
+        cost = time.perf_counter() - start
+
+        # Objects which cannot be serialized are not cached
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return value
+
+        _store[key] = data
+        memory_governor.add(
+            key,
+            size=len(data),
+            cost=cost,
+            evict=lambda: _evict(key),
+            group=name,
+            max_entries=max_entries
+        )
+
+        return value
+
+    def clear():
+        for key in [key for key in list(_store.keys()) if key[0] == name]:
+            _store.pop(key, None)
+            memory_governor.discard(key)
+
+    wrapper.clear = clear
+
+    return wrapper
+
+
+def set_cache_budget(budget: int) -> None:
+    """Set the total number of bytes which may be used by all caches."""
+
+    memory_governor.set_budget(budget)
+
+
+def cache_stats() -> pd.DataFrame:
+    """
+    Return the number of cache hits and misses for each function,
+    along with the bytes used by its cached outputs and the number
+    which have been evicted.
+    """
+
+    with _stats_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+
+    usage = memory_governor.usage().set_index("Group")
+
+    def usage_val(name: str, cname: str) -> Any:
+        return usage[cname].get(name, 0)
+
+    return pd.DataFrame(
+        [
+            dict(
+                Function=name,
+                Hits=counts["calls"] - counts["misses"],
+                Misses=counts["misses"],
+                Bytes=usage_val(name, "Bytes"),
+                Evictions=usage_val(name, "Evictions")
+            )
+            for name, counts in sorted(stats.items())
+        ],
+        columns=["Function", "Hits", "Misses", "Bytes", "Evictions"]
+    )
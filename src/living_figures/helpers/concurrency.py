@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Union
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Pools of processes shared by every call to process_map, by size
+_process_pools: Dict[int, ProcessPoolExecutor] = dict()
+_process_pool_lock = threading.Lock()
+
+
+def thread_map(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 1
+) -> List[Any]:
+    """
+    Apply a function to every item, returning the results in input order.
+    If max_workers > 1, the items are processed concurrently on a
+    bounded pool of threads.
+    Any exception raised by the function is re-raised by the caller.
+    """
+
+    items = list(items)
+
+    # Run serially if only a single worker is available,
+    # or if threads are not supported (e.g. in Pyodide)
+    if (
+        max_workers is None or max_workers <= 1 or len(items) <= 1
+        or sys.platform == "emscripten"
+    ):
+        return [func(item) for item in items]
+
+    # Share the Streamlit script context of the calling thread with
+    # each of the workers so that caching and session state are available
+    ctx = get_script_run_ctx()
+
+    def attach_ctx():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items)),
+        initializer=attach_ctx
+    ) as pool:
+        return list(pool.map(func, items))
+
+
+def run_in_background(
+    func: Callable[[], Any]
+) -> Union[threading.Thread, None]:
+    """
+    Call a function in a daemon thread which shares the Streamlit
+    script context of the caller, returning the thread.
+    If threads are not supported (e.g. in Pyodide) the function is not run.
+    """
+
+    if sys.platform == "emscripten":
+        return None
+
+    thread = threading.Thread(target=func, daemon=True)
+
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        add_script_run_ctx(thread, ctx)
+
+    thread.start()
+
+    return thread
+
+
+def process_map(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: Union[int, None] = None
+) -> List[Any]:
+    """
+    Apply a function to every item in a pool of processes, returning the
+    results in input order. The function and items must be picklable
+    (i.e. the function must be defined at the top level of a module).
+    The pool has max_workers processes (by default, one for each CPU),
+    and is started on first use and shared by every caller with the same
+    max_workers, so that the cost of starting the processes is only paid once.
+    The items are processed serially if max_workers <= 1, if only one
+    CPU is available, if processes are not supported (e.g. in Pyodide),
+    or if this is already a worker process (e.g. of a batch of figures),
+    so that pools of processes are never nested.
+    """
+
+    items = list(items)
+
+    n_cpus = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = n_cpus
+    max_workers = min(max_workers, n_cpus, len(items))
+
+    if (
+        max_workers <= 1
+        or sys.platform == "emscripten"
+        or multiprocessing.parent_process() is not None
+    ):
+        return [func(item) for item in items]
+
+    return list(_get_process_pool(max_workers).map(func, items))
+
+
+def _get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+
+    with _process_pool_lock:
+        if max_workers not in _process_pools:
+            # Worker processes are started fresh, rather than forked from
+            # a process which may be running other threads
+            _process_pools[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pools[max_workers]
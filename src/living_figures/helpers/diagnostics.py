@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+from functools import wraps
+import threading
+from time import perf_counter
+from typing import Callable, Dict
+from living_figures.helpers.tracing import traced
+
+# Timings being recorded by the current thread (if any)
+_local = threading.local()
+
+
+@contextmanager
+def record_timings(timings: Dict[str, float]):
+    """
+    Record the wall time spent in each stage (as marked by @timed)
+    by this thread while the block is executed.
+    The time spent in each stage is added to the timings dict,
+    along with the total time spent in the block.
+    """
+
+    prev = (getattr(_local, "frames", None), getattr(_local, "timings", None))
+    _local.frames = []
+    _local.timings = timings
+    start = perf_counter()
+
+    try:
+        yield timings
+    finally:
+        elapsed = perf_counter() - start
+        timings["total"] = timings.get("total", 0.) + elapsed
+        _local.frames, _local.timings = prev
+
+
+def timed(stage: str):
+    """
+    Decorator which attributes the time spent in a function to a stage.
+    Time spent in any nested function which is also timed is attributed to
+    the stage of that nested function instead.
+    No time is recorded unless the call is made inside record_timings().
+    Each call is also recorded as a span in the trace, if tracing is enabled.
+    """
+
+    def decorator(func: Callable):
+
+        func = traced(func.__qualname__, cat=stage)(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            frames = getattr(_local, "frames", None)
+            if frames is None:
+                return func(*args, **kwargs)
+
+            # Keep track of the time spent in nested stages
+            frames.append(0.)
+            start = perf_counter()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                nested = frames.pop()
+                timings = _local.timings
+                timings[stage] = timings.get(stage, 0.) + elapsed - nested
+                if len(frames) > 0:
+                    frames[-1] += elapsed
+
+        return wrapper
+
+    return decorator
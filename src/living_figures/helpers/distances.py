@@ -0,0 +1,226 @@
+import os
+from typing import Iterable, Tuple, Union
+import numpy as np
+import pandas as pd
+from scipy.spatial import distance
+from living_figures.helpers.concurrency import process_map, thread_map
+
+# Metrics supported by pairwise_distances, for which the distance
+# between two samples does not depend on any of the other samples
+TILED_METRICS = ["braycurtis", "euclidean", "jensenshannon"]
+
+
+class CondensedDistances:
+    """
+    Distances between every pair of samples, stored as the condensed
+    vector returned by scipy.spatial.distance.pdist (the upper triangle
+    of the square matrix, row by row) instead of the full n x n matrix.
+
+    The positions of the two samples in each pair are computed once
+    (when first needed) using the smallest integer type which fits,
+    and subsets of samples are selected by position.
+    """
+
+    def __init__(self, values: np.ndarray, samples: Iterable):
+
+        self.values = values
+        self.samples = pd.Index(samples)
+
+        n_samples = self.samples.shape[0]
+        if values.shape[0] != n_samples * (n_samples - 1) // 2:
+            msg = f"{values.shape[0]:,} distances do not match "
+            msg = f"{msg}{n_samples:,} samples"
+            raise ValueError(msg)
+
+        self._pairs = None
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes used by the distances (and pair positions)."""
+
+        nbytes = self.values.nbytes
+        if self._pairs is not None:
+            nbytes += sum(positions.nbytes for positions in self._pairs)
+        return nbytes
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the positions of the first and second sample in each pair."""
+
+        if self._pairs is None:
+
+            n_samples = self.samples.shape[0]
+            dtype = np.min_scalar_type(max(n_samples - 1, 0))
+            positions = np.arange(n_samples, dtype=dtype)
+
+            # Each row of the upper triangle is filled in turn, so that
+            # no arrays of 64-bit integers are made for every pair
+            first = np.repeat(positions, np.arange(n_samples)[::-1])
+            second = np.empty_like(first)
+            start = 0
+            for ix in range(n_samples - 1):
+                n_pairs = n_samples - ix - 1
+                second[start:start + n_pairs] = positions[ix + 1:]
+                start += n_pairs
+
+            self._pairs = (first, second)
+
+        return self._pairs
+
+    def subset(self, samples: Iterable) -> "CondensedDistances":
+        """
+        Return the distances between the samples which are listed
+        (ignoring any which are missing), in their original order.
+        """
+
+        positions = self.samples.get_indexer(pd.Index(samples).unique())
+        positions = np.sort(positions[positions >= 0])
+
+        n_samples = self.samples.shape[0]
+        if positions.shape[0] == n_samples:
+            return self
+
+        # Copy the distances of each row of the upper triangle in turn
+        n_subset = positions.shape[0]
+        values = np.empty(n_subset * (n_subset - 1) // 2, self.values.dtype)
+        start = 0
+        for ix, row in enumerate(positions[:-1]):
+            row_start = n_samples * row - row * (row + 1) // 2 - row - 1
+            n_pairs = n_subset - ix - 1
+            values[start:start + n_pairs] = self.values[
+                row_start + positions[ix + 1:]
+            ]
+            start += n_pairs
+
+        return CondensedDistances(values, self.samples[positions])
+
+    def square(self) -> pd.DataFrame:
+        """Return the full matrix of distances, indexed by sample."""
+
+        return pd.DataFrame(
+            distance.squareform(self.values, checks=False),
+            index=self.samples,
+            columns=self.samples
+        )
+
+
+def pairwise_distances(
+    data: np.ndarray,
+    metric: str = "euclidean",
+    tile_size: int = 1024,
+    max_workers: Union[int, None] = None,
+    processes: bool = False,
+    out: Union[np.ndarray, None] = None
+) -> np.ndarray:
+    """
+    Return the condensed distances between every pair of rows (samples)
+    of an array, identical to scipy.spatial.distance.pdist.
+
+    The upper triangle of the square matrix is split into tiles of
+    tile_size x tile_size samples, which are computed with the same
+    kernels as pdist on a pool of threads (or processes), one tile for
+    each worker at a time. The memory used beyond the distances is
+    bounded by the size of each tile, and the distances may be written
+    into any array (e.g. a np.memmap on disk) of the right size.
+
+    Args:
+        data (np.ndarray):    Array with a row for each sample.
+        metric (str):         "braycurtis", "euclidean" or "jensenshannon".
+        tile_size (int):      Number of samples on each side of a tile.
+        max_workers (int):    (optional) Number of threads or processes
+                              (default: the number of CPUs).
+        processes (bool):     Use a pool of processes instead of threads.
+        out (np.ndarray):     (optional) Array to write the distances into.
+    """
+
+    if metric not in TILED_METRICS:
+        msg = f"Metric must be one of {', '.join(TILED_METRICS)}, not {metric}"
+        raise ValueError(msg)
+
+    n_samples = data.shape[0]
+    n_pairs = n_samples * (n_samples - 1) // 2
+
+    if out is None:
+        out = np.empty(n_pairs, dtype=np.float64)
+    elif out.shape != (n_pairs,):
+        raise ValueError(f"Output must have {n_pairs:,} elements")
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    # Tiles in the upper triangle, by their first row and column
+    tiles = [
+        (row, col)
+        for row in range(0, n_samples, tile_size)
+        for col in range(row, n_samples, tile_size)
+    ]
+
+    # Small matrices are computed in a single call
+    if len(tiles) <= 1:
+        out[:] = distance.pdist(data, metric=metric)
+        return out
+
+    # Tiles on the diagonal only compute their upper triangle
+    def tile_args(tile: Tuple[int, int]):
+        row, col = tile
+        return (
+            data[row:row + tile_size],
+            None if row == col else data[col:col + tile_size],
+            metric
+        )
+
+    for start in range(0, len(tiles), max_workers):
+        batch = tiles[start:start + max_workers]
+        args = [tile_args(tile) for tile in batch]
+
+        if processes:
+            results = process_map(_tile_distances, args, max_workers)
+        else:
+            results = thread_map(_tile_distances, args, max_workers)
+
+        for (row, col), tile_dists in zip(batch, results):
+            _write_tile(out, n_samples, row, col, tile_dists)
+
+    return out
+
+
+def _tile_distances(args) -> np.ndarray:
+    """
+    Compute the distances between two blocks of samples,
+    or between the samples in a single block (in condensed form).
+    """
+
+    rows, cols, metric = args
+    if cols is None:
+        return distance.pdist(rows, metric=metric)
+    return distance.cdist(rows, cols, metric=metric)
+
+
+def _write_tile(
+    out: np.ndarray,
+    n_samples: int,
+    row: int,
+    col: int,
+    tile_dists: np.ndarray
+) -> None:
+    """Copy the distances of a tile into the condensed distances."""
+
+    # Tiles on the diagonal are already condensed
+    if tile_dists.ndim == 1:
+        n_rows = int((1 + np.sqrt(1 + 8 * tile_dists.shape[0])) / 2)
+        tile_start = 0
+        for ix in range(n_rows - 1):
+            sample = row + ix
+            start = n_samples * sample - sample * (sample + 1) // 2
+            n_pairs = n_rows - ix - 1
+            out[start:start + n_pairs] = tile_dists[
+                tile_start:tile_start + n_pairs
+            ]
+            tile_start += n_pairs
+        return
+
+    n_rows, n_cols = tile_dists.shape
+    for ix in range(n_rows):
+        sample = row + ix
+        start = n_samples * sample - sample * (sample + 1) // 2
+        start += col - sample - 1
+        out[start:start + n_cols] = tile_dists[ix]
@@ -0,0 +1,207 @@
+from collections import defaultdict
+import os
+import pickle
+import sys
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Union
+import numpy as np
+import pandas as pd
+
+# Default budget for all cached objects, which may be set (in MB)
+# using the LIVING_FIGURES_CACHE_MB environment variable
+DEFAULT_BUDGET = int(os.environ.get("LIVING_FIGURES_CACHE_MB", 1024)) * 2**20
+
+
+def sizeof(obj: Any) -> int:
+    """Return the approximate number of bytes used by an object."""
+
+    if isinstance(obj, bytes):
+        return len(obj)
+    elif isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    elif isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    elif isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    elif isinstance(getattr(obj, "nbytes", None), int):
+        return obj.nbytes
+    elif isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(sizeof(i) for i in obj)
+    elif isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            sizeof(k) + sizeof(v) for k, v in obj.items()
+        )
+    elif obj is None or isinstance(obj, (str, int, float, bool)):
+        return sys.getsizeof(obj)
+
+    # Other objects are measured by their serialized size
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
+
+
+class MemoryGovernor:
+    """
+    Keep the total size of every cached object in the process within
+    a budget (in bytes), across all of the caches which register with it.
+
+    Entries are evicted by cost-aware LRU (GreedyDual-Size): each time an
+    entry is stored or used, its priority is set to the current clock plus
+    the time taken to compute it divided by its size. The entry with the
+    lowest priority is evicted first, and the clock advances to its priority.
+    Large objects which are cheap to recompute and have not been used
+    recently are therefore the first to be evicted.
+    """
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+
+        self.budget = budget
+
+        # Size, cost, priority, group and eviction callback for each key
+        self._entries: Dict[Hashable, dict] = dict()
+        self._clock = 0.
+        self._lock = threading.Lock()
+
+        # Number of entries evicted from each group
+        self.evictions: Dict[str, int] = defaultdict(int)
+
+    def add(
+        self,
+        key: Hashable,
+        size: int,
+        cost: float,
+        evict: Callable[[], None],
+        group: str = "",
+        max_entries: Union[int, None] = None
+    ) -> None:
+        """
+        Track an object which has been added to a cache.
+        The evict() callback is used to remove it from that cache.
+        No more than max_entries will be kept for the group.
+        """
+
+        with self._lock:
+
+            self._entries[key] = dict(
+                size=size,
+                cost=cost,
+                group=group,
+                evict=evict,
+                priority=self._priority(size, cost)
+            )
+
+            victims = self._select_victims(group, max_entries)
+
+        # Remove the evicted objects from their caches
+        for entry in victims:
+            entry["evict"]()
+
+    def touch(self, key: Hashable) -> None:
+        """Mark an object as having been used."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["priority"] = self._priority(
+                    entry["size"],
+                    entry["cost"]
+                )
+
+    def discard(self, key: Hashable) -> None:
+        """Stop tracking an object which was removed from its cache."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def set_budget(self, budget: int) -> None:
+        """Set the budget (in bytes), evicting objects if needed."""
+
+        with self._lock:
+            self.budget = budget
+            victims = self._select_victims()
+
+        for entry in victims:
+            entry["evict"]()
+
+    def total_bytes(self, group: Union[str, None] = None) -> int:
+        """Return the number of bytes used by all objects (or a group)."""
+
+        with self._lock:
+            return sum(
+                entry["size"]
+                for entry in self._entries.values()
+                if group is None or entry["group"] == group
+            )
+
+    def usage(self) -> pd.DataFrame:
+        """Return the number of entries, bytes and evictions for each group."""
+
+        with self._lock:
+            groups = set(self.evictions.keys()) | set(
+                entry["group"] for entry in self._entries.values()
+            )
+            return pd.DataFrame(
+                [
+                    dict(
+                        Group=group,
+                        Entries=len(self._group_keys(group)),
+                        Bytes=sum(
+                            self._entries[key]["size"]
+                            for key in self._group_keys(group)
+                        ),
+                        Evictions=self.evictions[group]
+                    )
+                    for group in sorted(groups)
+                ],
+                columns=["Group", "Entries", "Bytes", "Evictions"]
+            )
+
+    def _priority(self, size: int, cost: float) -> float:
+        # Very fast functions are still ordered by how recently they were used
+        return self._clock + max(cost, 1e-6) / max(size, 1)
+
+    def _group_keys(self, group: str) -> List[Hashable]:
+        return [
+            key
+            for key, entry in self._entries.items()
+            if entry["group"] == group
+        ]
+
+    def _pop_lowest(self, keys: List[Hashable]) -> dict:
+        """Remove the entry with the lowest priority, advancing the clock."""
+
+        key = min(keys, key=lambda k: self._entries[k]["priority"])
+        entry = self._entries.pop(key)
+        self._clock = max(self._clock, entry["priority"])
+        self.evictions[entry["group"]] += 1
+        return entry
+
+    def _select_victims(
+        self,
+        group: Union[str, None] = None,
+        max_entries: Union[int, None] = None
+    ) -> List[dict]:
+        """Remove entries to meet the limits, returning those evicted."""
+
+        victims = []
+
+        # Limit the number of entries for the group
+        if group is not None and max_entries is not None:
+            keys = self._group_keys(group)
+            while len(keys) > max_entries:
+                victims.append(self._pop_lowest(keys))
+                keys = self._group_keys(group)
+
+        # Limit the total size of all entries
+        total = sum(entry["size"] for entry in self._entries.values())
+        while total > self.budget and len(self._entries) > 0:
+            entry = self._pop_lowest(list(self._entries.keys()))
+            total -= entry["size"]
+            victims.append(entry)
+
+        return victims
+
+
+# Governor shared by all of the caches in this process
+memory_governor = MemoryGovernor()
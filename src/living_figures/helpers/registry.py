@@ -0,0 +1,216 @@
+from collections import OrderedDict, defaultdict
+from hashlib import md5
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Set, Union
+import numpy as np
+import pandas as pd
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from living_figures.helpers.distances import CondensedDistances
+from living_figures.helpers.memory import memory_governor, sizeof
+from living_figures.helpers.tracing import span
+
+# Owner used for objects requested outside of a Streamlit session
+LOCAL_OWNER = "local"
+
+
+def content_hash(obj: Any) -> str:
+    """Return a hash of the contents of a DataFrame, Series, or object."""
+
+    hasher = md5()
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        try:
+            hasher.update(
+                pd.util.hash_pandas_object(obj, index=True).values.tobytes()
+            )
+        except TypeError:
+            # Tables with unhashable values (e.g. lists) are serialized
+            hasher.update(pickle.dumps(obj))
+        if isinstance(obj, pd.DataFrame):
+            hasher.update(pickle.dumps(list(obj.columns.values)))
+        else:
+            hasher.update(pickle.dumps(obj.name))
+    else:
+        hasher.update(pickle.dumps(obj))
+
+    return hasher.hexdigest()
+
+
+def current_session() -> str:
+    """Return the id of the Streamlit session running in this thread."""
+
+    ctx = get_script_run_ctx()
+    return LOCAL_OWNER if ctx is None else ctx.session_id
+
+
+def _is_active(owner: str) -> bool:
+    """Sessions are active until they are closed by the Streamlit runtime."""
+
+    if owner == LOCAL_OWNER or not runtime.exists():
+        return True
+    return runtime.get_instance().is_active_session(owner)
+
+
+def _freeze(obj: Any) -> Any:
+    """
+    Mark any numpy arrays as read-only before they are shared, including
+    the arrays which hold the numeric values of DataFrames and Series.
+    Arrays of objects (e.g. strings) are left writeable, because pandas
+    cannot compare them when they are read-only.
+    """
+
+    if isinstance(obj, np.ndarray):
+        if obj.dtype != object:
+            obj.flags.writeable = False
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        for values in obj._mgr.arrays:
+            if isinstance(values, pd.arrays.SparseArray):
+                values = values.sp_values
+            _freeze(values)
+    elif isinstance(obj, CondensedDistances):
+        _freeze(obj.values)
+    elif isinstance(obj, tuple):
+        for i in obj:
+            _freeze(i)
+    return obj
+
+
+class SharedRegistry:
+    """
+    Process-wide store of objects which are shared by every session
+    working with the same data (e.g. parsed datasets and distance matrices).
+
+    Objects are keyed by the content hash of their inputs, and must be
+    treated as read-only by the caller.
+    Each entry keeps a reference to every session which has requested it,
+    and is evicted once all of those sessions have been closed.
+    Entries may also be evicted by the memory governor to stay within
+    the memory budget, in which case they are created again when needed.
+    At most max_entries objects are kept, evicting the least recently used.
+    """
+
+    max_entries = 256
+
+    def __init__(self, max_entries: Union[int, None] = None):
+
+        if max_entries is not None:
+            self.max_entries = max_entries
+
+        self._entries: Dict[Hashable, Any] = OrderedDict()
+        self._owners: Dict[Hashable, Set[str]] = dict()
+
+        # Lock used to modify the entries, and locks used for each key
+        # to prevent the same object from being computed twice at once
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = defaultdict(
+            threading.Lock
+        )
+
+    def get(
+        self,
+        key: Hashable,
+        func: Callable[[], Any],
+        owner: Union[str, None] = None
+    ) -> Any:
+        """
+        Return the object stored for a key, calling func() to create it
+        if it does not exist. The requesting session becomes an owner.
+        """
+
+        if owner is None:
+            owner = current_session()
+
+        self.prune()
+
+        with self._key_locks[key]:
+
+            with self._lock:
+                if key in self._entries:
+                    self._owners[key].add(owner)
+                    self._entries.move_to_end(key)
+                    obj = self._entries[key]
+                    memory_governor.touch(("registry", key))
+                    return obj
+
+            start = time.perf_counter()
+            with span("registry miss", cat="registry", key=str(key[0])):
+                obj = _freeze(func())
+            cost = time.perf_counter() - start
+
+            with self._lock:
+                self._entries[key] = obj
+                self._owners[key] = {owner}
+
+                # Evict the least recently used objects beyond the limit
+                while len(self._entries) > self.max_entries:
+                    self._evict(next(iter(self._entries)))
+
+        # Objects are grouped by the first element of the key
+        group = key[0] if isinstance(key, tuple) else key
+        memory_governor.add(
+            ("registry", key),
+            size=sizeof(obj),
+            cost=cost,
+            evict=lambda: self.discard(key),
+            group=f"SharedRegistry: {group}"
+        )
+
+        return obj
+
+    def refcount(self, key: Hashable) -> int:
+        """Return the number of sessions which reference an object."""
+
+        with self._lock:
+            return len(self._owners.get(key, set()))
+
+    def discard(self, key: Hashable) -> None:
+        """Remove an object from the registry."""
+
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def release(self, owner: str) -> None:
+        """Drop all references held by a session, evicting unused objects."""
+
+        with self._lock:
+            for key in list(self._owners.keys()):
+                self._owners[key].discard(owner)
+                if len(self._owners[key]) == 0:
+                    self._evict(key)
+
+    def prune(self) -> None:
+        """Release the references held by any sessions which have closed."""
+
+        with self._lock:
+            owners = set().union(*self._owners.values())
+
+        for owner in owners:
+            if not _is_active(owner):
+                self.release(owner)
+
+    def clear(self) -> None:
+        """Remove all objects from the registry."""
+
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._evict(key)
+
+    def _evict(self, key: Hashable) -> None:
+        del self._entries[key]
+        del self._owners[key]
+        self._key_locks.pop(key, None)
+        memory_governor.discard(("registry", key))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Registry shared by all sessions in this process
+shared_datasets = SharedRegistry()
@@ -0,0 +1,96 @@
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import re
+from typing import Dict, Iterator, List
+
+
+class SearchIndex:
+    """
+    Index used to find the entries in a list which contain a query string.
+
+    Each entry may be labeled with a prefix (e.g. "genus: Bacteroides"),
+    in which case only the text following the separator is searched.
+    Matches are ranked with entries which start with the query first,
+    then entries with a word which starts with the query (each in
+    alphabetical order), and then any entries which contain the query
+    (in their original order). The search stops once enough matches
+    have been found, so common queries are as fast as rare ones.
+    """
+
+    def __init__(self, entries: List[str], sep=": "):
+
+        self.entries = list(entries)
+
+        # Lowercase text which is searched for each entry
+        keys = [
+            entry.split(sep, 1)[-1].lower()
+            for entry in self.entries
+        ]
+
+        # Sorted list of (key, position) for finding prefix matches
+        self._prefixes = sorted(
+            (key, ix) for ix, key in enumerate(keys)
+        )
+
+        # Sorted list of (word, position) for each word in every key,
+        # excluding the first word (which is matched as a prefix)
+        self._words = sorted(
+            (word, ix)
+            for ix, key in enumerate(keys)
+            for word in re.split(r"[\s_\-\.\|]+", key)[1:]
+            if len(word) > 0
+        )
+
+        # All of the keys joined into a single string for substring matches,
+        # along with the position at which each key starts
+        self._text = "\n".join(keys)
+        self._starts = list(accumulate(
+            [0] + [len(key) + 1 for key in keys[:-1]]
+        ))
+
+    def search(self, query: str, n=100) -> List[str]:
+        """Return up to n entries which contain the query."""
+
+        if query is None or len(query.strip()) == 0:
+            return self.entries[:n]
+
+        query = query.strip().lower()
+
+        # Each group of matches is only searched if the previous
+        # groups did not contain enough matches
+        matches: Dict[int, bool] = dict()
+        for ixs in [
+            self._match_prefix(self._prefixes, query),
+            self._match_prefix(self._words, query),
+            self._match_substring(query)
+        ]:
+            for ix in ixs:
+                matches[ix] = True
+                if len(matches) >= n:
+                    break
+            if len(matches) >= n:
+                break
+
+        return [self.entries[ix] for ix in matches.keys()]
+
+    @staticmethod
+    def _match_prefix(keys: List[tuple], query: str) -> Iterator[int]:
+        """Yield the position of each sorted key starting with the query."""
+
+        for i in range(bisect_left(keys, (query,)), len(keys)):
+            key, ix = keys[i]
+            if not key.startswith(query):
+                break
+            yield ix
+
+    def _match_substring(self, query: str) -> Iterator[int]:
+        """Yield the position of each key containing the query, in order."""
+
+        if "\n" in query:
+            return
+
+        for m in re.finditer(re.escape(query), self._text):
+            yield bisect_right(self._starts, m.start()) - 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,272 @@
+import atexit
+from collections import deque
+from functools import wraps
+import inspect
+import json
+import os
+import threading
+from time import perf_counter_ns
+from typing import Any, Callable, Deque, Dict, List, Tuple, Union
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Tracing is enabled on import if LIVING_FIGURES_TRACE is set to the
+# path of the file which the trace will be written to on exit
+TRACE_ENV = "LIVING_FIGURES_TRACE"
+
+# Types of parameters which are recorded for each span
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class Tracer:
+    """
+    Record nested spans of time (e.g. reading a file or making a figure)
+    in the Chrome trace-event format, which can be viewed in a local
+    trace viewer (e.g. chrome://tracing or https://ui.perfetto.dev).
+
+    Spans on the same thread are nested by their start and end times.
+    No events are recorded unless the tracer has been enabled, and only
+    the most recent max_events spans are kept.
+    Each span is recorded along with the id of the Streamlit session
+    which it ran for (if any), so that a session can export its own spans.
+    """
+
+    max_events = 100000
+
+    def __init__(self, max_events: Union[int, None] = None):
+
+        if max_events is not None:
+            self.max_events = max_events
+
+        self.enabled = False
+        self._events: Deque[Tuple[Union[str, None], dict]] = deque(
+            maxlen=self.max_events
+        )
+        self._threads: Dict[int, str] = dict()
+        self._lock = threading.Lock()
+        self._start = perf_counter_ns()
+
+    def enable(self) -> None:
+        """Start recording spans."""
+
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording spans (keeping any which were recorded)."""
+
+        self.enabled = False
+
+    def clear(self) -> None:
+        """Remove all recorded spans."""
+
+        with self._lock:
+            self._events.clear()
+            self._threads = dict()
+
+    def now(self) -> float:
+        """Microseconds since the tracer was created."""
+
+        return (perf_counter_ns() - self._start) / 1000.
+
+    def add(self, name: str, cat: str, start: float, params: dict) -> None:
+        """Record a span which started at a time given by now()."""
+
+        thread = threading.current_thread()
+        event = dict(
+            name=name,
+            cat=cat,
+            ph="X",
+            ts=start,
+            dur=self.now() - start,
+            pid=os.getpid(),
+            tid=thread.ident,
+            args=params
+        )
+
+        ctx = get_script_run_ctx()
+        session = None if ctx is None else ctx.session_id
+
+        with self._lock:
+            self._events.append((session, event))
+            self._threads[thread.ident] = thread.name
+
+    def events(self, session: Union[str, None] = None) -> List[dict]:
+        """
+        Return the recorded spans, along with the name of each thread.
+        If a session id is provided, only the spans recorded for that
+        session are returned.
+        """
+
+        with self._lock:
+            events = [
+                event
+                for event_session, event in self._events
+                if session is None or event_session == session
+            ]
+            tids = set(event["tid"] for event in events)
+            return [
+                dict(
+                    name="thread_name",
+                    ph="M",
+                    pid=os.getpid(),
+                    tid=tid,
+                    args=dict(name=name)
+                )
+                for tid, name in self._threads.items()
+                if tid in tids
+            ] + events
+
+    def to_json(self, session: Union[str, None] = None) -> str:
+        """
+        Return the trace in the Chrome trace-event JSON format
+        (optionally only including the spans of a single session).
+        """
+
+        return json.dumps(
+            dict(traceEvents=self.events(session), displayTimeUnit="ms")
+        )
+
+    def export(self, fp: str) -> None:
+        """Write the trace to a file."""
+
+        with open(fp, "w") as handle:
+            handle.write(self.to_json())
+
+
+# Tracer shared by every thread in this process
+tracer = Tracer()
+
+
+class _Span:
+    """Context manager which records a span when it exits."""
+
+    __slots__ = ("name", "cat", "params", "start")
+
+    def __init__(self, name: str, cat: str, params: dict):
+        self.name = name
+        self.cat = cat
+        self.params = params
+
+    def __enter__(self):
+        self.start = tracer.now()
+        return self
+
+    def __exit__(self, *exc):
+        tracer.add(self.name, self.cat, self.start, self.params)
+        return False
+
+
+class _NullSpan:
+    """Context manager used when tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name: str, cat: str = "", **params):
+    """
+    Context manager which records the time spent in a block, along with
+    any parameters given as keyword arguments.
+    """
+
+    if not tracer.enabled:
+        return _null_span
+    return _Span(name, cat, _format_params(params))
+
+
+def traced(name: Union[str, None] = None, cat: str = ""):
+    """
+    Decorator which records a span for each call to a function.
+    The span is named for the function unless a name is provided,
+    and any arguments with scalar values are recorded as parameters
+    (except for those starting with an underscore, e.g. _self).
+    """
+
+    def decorator(func: Callable):
+
+        span_name = func.__qualname__ if name is None else name
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+
+            with _Span(span_name, cat, _bind_params(signature, args, kwargs)):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _bind_params(signature: inspect.Signature, args, kwargs) -> dict:
+    """Return the parameters of a function call, by name."""
+
+    try:
+        bound = signature.bind(*args, **kwargs).arguments
+    except TypeError:
+        return dict()
+
+    params = dict()
+    for kw, val in bound.items():
+        # Any keyword arguments collected by **kwargs are listed separately
+        if signature.parameters[kw].kind == inspect.Parameter.VAR_KEYWORD:
+            params.update(val)
+        else:
+            params[kw] = val
+
+    return _format_params(params)
+
+
+def _format_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the parameters which can be shown in the trace viewer."""
+
+    return {
+        kw: val if isinstance(val, _SCALARS) else _describe(val)
+        for kw, val in params.items()
+        if not kw.startswith("_") and kw != "self"
+    }
+
+
+def _describe(val: Any) -> str:
+    """Describe a parameter by its type (and shape, for arrays)."""
+
+    if isinstance(val, type):
+        return val.__name__
+
+    shape = getattr(val, "shape", None)
+    if isinstance(shape, tuple):
+        return f"{type(val).__name__}{shape}"
+    return type(val).__name__
+
+
+def enable_tracing() -> None:
+    """Start recording spans."""
+
+    tracer.enable()
+
+
+def disable_tracing() -> None:
+    """Stop recording spans."""
+
+    tracer.disable()
+
+
+def export_trace(fp: str) -> None:
+    """Write all of the recorded spans to a Chrome trace-event JSON file."""
+
+    tracer.export(fp)
+
+
+if os.environ.get(TRACE_ENV):
+    tracer.enable()
+    atexit.register(tracer.export, os.environ[TRACE_ENV])
@@ -0,0 +1,355 @@
+from living_figures.helpers import process_map, thread_map
+from living_figures.helpers import record_timings, timed
+from living_figures.helpers.distances import pairwise_distances
+from living_figures.helpers.memory import MemoryGovernor
+from living_figures.helpers.registry import SharedRegistry
+from living_figures.helpers.search import SearchIndex
+from living_figures.helpers.tracing import Tracer, tracer, span, traced
+import json
+from pathlib import Path
+import tempfile
+import time
+from types import SimpleNamespace
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from scipy.spatial import distance
+
+
+class TestThreadMap(unittest.TestCase):
+
+    def test_order(self):
+
+        items = list(range(20))
+        for max_workers in [1, 4]:
+            self.assertEqual(
+                thread_map(lambda i: i * 2, items, max_workers=max_workers),
+                [i * 2 for i in items]
+            )
+
+    def test_exception(self):
+
+        def f(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+
+        with self.assertRaises(ValueError):
+            thread_map(f, range(5), max_workers=2)
+
+
+class TestProcessMap(unittest.TestCase):
+
+    def test_pool_size(self):
+
+        module = "living_figures.helpers.concurrency"
+        with patch(f"{module}.os.cpu_count", return_value=8), \
+                patch(f"{module}._get_process_pool") as get_pool:
+            get_pool.return_value.map = map
+
+            # The pool is no larger than max_workers
+            self.assertEqual(process_map(abs, [-1, -2, -3], 2), [1, 2, 3])
+            get_pool.assert_called_once_with(2)
+
+            # Or the number of items
+            process_map(abs, [-1, -2, -3])
+            get_pool.assert_called_with(3)
+
+            # Worker processes never start another pool
+            get_pool.reset_mock()
+            with patch(
+                f"{module}.multiprocessing.parent_process",
+                return_value=object()
+            ):
+                self.assertEqual(process_map(abs, [-1, -2], 2), [1, 2])
+            get_pool.assert_not_called()
+
+
+class TestTimed(unittest.TestCase):
+
+    def test_nested_stages(self):
+
+        @timed("inner")
+        def inner():
+            time.sleep(0.02)
+
+        @timed("outer")
+        def outer():
+            inner()
+
+        # Nothing is recorded outside of record_timings()
+        outer()
+
+        timings = dict()
+        with record_timings(timings):
+            outer()
+
+        self.assertGreaterEqual(timings["inner"], 0.02)
+        self.assertLess(timings["outer"], timings["inner"])
+        self.assertGreaterEqual(
+            timings["total"],
+            timings["inner"] + timings["outer"]
+        )
+
+
+class TestTracing(unittest.TestCase):
+
+    def tearDown(self):
+        tracer.disable()
+        tracer.clear()
+
+    def test_spans(self):
+
+        @traced(cat="test")
+        def inner(x, _y=None):
+            time.sleep(0.01)
+            return x
+
+        tracer.clear()
+        tracer.enable()
+        with span("outer", size=2):
+            inner(1, _y=[])
+
+        events = json.loads(tracer.to_json())["traceEvents"]
+        spans = {e["name"]: e for e in events if e["ph"] == "X"}
+        self.assertEqual(len(events), 3)
+        self.assertEqual(spans["outer"]["args"], dict(size=2))
+
+        # Only scalar arguments without an underscore are recorded
+        inner_span = spans[inner.__qualname__]
+        self.assertEqual(inner_span["args"], dict(x=1))
+        self.assertEqual(inner_span["cat"], "test")
+
+        # The inner span is nested within the outer span
+        self.assertGreaterEqual(inner_span["ts"], spans["outer"]["ts"])
+        self.assertLessEqual(
+            inner_span["ts"] + inner_span["dur"],
+            spans["outer"]["ts"] + spans["outer"]["dur"]
+        )
+        self.assertGreaterEqual(inner_span["dur"], 10000)
+
+    def test_bounded(self):
+
+        bounded = Tracer(max_events=2)
+        bounded.enable()
+        for name in ["a", "b", "c"]:
+            bounded.add(name, "", bounded.now(), dict())
+
+        # Only the most recent spans are kept
+        spans = [e["name"] for e in bounded.events() if e["ph"] == "X"]
+        self.assertEqual(spans, ["b", "c"])
+
+    def test_sessions(self):
+
+        tracer.enable()
+        for session in ["a", "b"]:
+            ctx = SimpleNamespace(session_id=session)
+            with patch(
+                "living_figures.helpers.tracing.get_script_run_ctx",
+                return_value=ctx
+            ):
+                with span(f"span {session}", user=session):
+                    pass
+
+        # Each session only exports its own spans
+        events = json.loads(tracer.to_json(session="a"))["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual([e["name"] for e in spans], ["span a"])
+        self.assertEqual(len(tracer.events()), 3)
+
+    def test_disabled(self):
+
+        @traced()
+        def func():
+            return 1
+
+        tracer.clear()
+        with span("outer"):
+            self.assertEqual(func(), 1)
+        self.assertEqual(tracer.events(), [])
+        self.assertEqual(Tracer().events(), [])
+
+
+class TestSharedRegistry(unittest.TestCase):
+
+    def test_shared(self):
+
+        registry = SharedRegistry()
+        calls = []
+
+        def make():
+            calls.append(1)
+            return [1, 2, 3]
+
+        a = registry.get("key", make, owner="a")
+        b = registry.get("key", make, owner="b")
+
+        # The object is only computed once, and shared by both owners
+        self.assertIs(a, b)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(registry.refcount("key"), 2)
+
+        # The object is evicted once all owners have been released
+        registry.release("a")
+        self.assertIn("key", registry)
+        registry.release("b")
+        self.assertNotIn("key", registry)
+
+    def test_frozen(self):
+
+        registry = SharedRegistry()
+        df = registry.get(
+            "df",
+            lambda: pd.DataFrame(dict(a=[1., 2.], b=[3, 4], c=["x", "y"]))
+        )
+
+        # The values of shared tables cannot be modified in place
+        for col in ["a", "b"]:
+            with self.assertRaises(ValueError):
+                df[col].values[0] = 0
+
+        # Copies can be modified
+        copy = df.copy()
+        copy.iloc[0, 0] = 0.
+        self.assertEqual(df.iloc[0, 0], 1.)
+
+    def test_max_entries(self):
+
+        registry = SharedRegistry(max_entries=2)
+        registry.get("a", lambda: 1)
+        registry.get("b", lambda: 2)
+        registry.get("a", lambda: 1)
+        registry.get("c", lambda: 3)
+
+        # The least recently used object is evicted
+        self.assertEqual(len(registry), 2)
+        self.assertIn("a", registry)
+        self.assertNotIn("b", registry)
+        self.assertIn("c", registry)
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def test_search(self):
+
+        index = SearchIndex([
+            "family: Bacteroidaceae",
+            "genus: Prevotella",
+            "species: Prevotella_copri",
+            "genus: Bacteroides",
+            "species: Escherichia_coli",
+        ])
+
+        # Prefix matches are returned in alphabetical order
+        self.assertEqual(
+            index.search("bacteroid"),
+            ["family: Bacteroidaceae", "genus: Bacteroides"]
+        )
+
+        # Matches to the start of a word precede other substrings
+        self.assertEqual(
+            index.search("co"),
+            ["species: Escherichia_coli", "species: Prevotella_copri"]
+        )
+        self.assertEqual(
+            index.search("ri"),
+            ["species: Prevotella_copri", "species: Escherichia_coli"]
+        )
+
+        # The rank is not searched
+        self.assertEqual(index.search("genus"), [])
+
+        # The number of results is limited
+        self.assertEqual(len(index.search("", n=2)), 2)
+        self.assertEqual(len(index.search("e", n=3)), 3)
+
+    def test_large(self):
+
+        index = SearchIndex([f"species: S{i:06d}" for i in range(200000)])
+
+        # Only the first matches in alphabetical order are collected
+        self.assertEqual(
+            index.search("s", n=3),
+            ["species: S000000", "species: S000001", "species: S000002"]
+        )
+        self.assertEqual(
+            index.search("99999", n=2),
+            ["species: S099999", "species: S199999"]
+        )
+        self.assertEqual(index.search("x"), [])
+
+
+class TestMemoryGovernor(unittest.TestCase):
+
+    def test_budget(self):
+
+        governor = MemoryGovernor(budget=100)
+        evicted = []
+
+        def add(key, size, cost, **kwargs):
+            governor.add(
+                key,
+                size=size,
+                cost=cost,
+                evict=lambda: evicted.append(key),
+                **kwargs
+            )
+
+        # Large objects which are cheap to compute are evicted first
+        add("cheap", 50, 0.001)
+        add("expensive", 50, 1.0)
+        add("new", 10, 0.1)
+        self.assertEqual(evicted, ["cheap"])
+        self.assertEqual(governor.total_bytes(), 60)
+
+        # The number of entries in a group can also be limited
+        add("a", 1, 0.1, group="g", max_entries=1)
+        add("b", 1, 0.1, group="g", max_entries=1)
+        self.assertEqual(evicted, ["cheap", "a"])
+
+        # Reducing the budget evicts entries
+        governor.set_budget(20)
+        self.assertLessEqual(governor.total_bytes(), 20)
+
+
+class TestPairwiseDistances(unittest.TestCase):
+    """Distances computed in tiles must be identical to pdist."""
+
+    def test_pdist(self):
+
+        data = np.random.default_rng(0).dirichlet(np.ones(20), size=53)
+
+        for metric in ["braycurtis", "euclidean", "jensenshannon"]:
+            expected = distance.pdist(data, metric=metric)
+            for tile_size in [1, 10, 100]:
+                for processes in [False, True]:
+                    np.testing.assert_array_equal(
+                        pairwise_distances(
+                            data,
+                            metric=metric,
+                            tile_size=tile_size,
+                            max_workers=2,
+                            processes=processes
+                        ),
+                        expected
+                    )
+
+    def test_memmap(self):
+
+        data = np.random.default_rng(0).random((40, 5))
+        expected = distance.pdist(data, metric="euclidean")
+
+        with tempfile.TemporaryDirectory() as folder:
+            out = np.memmap(
+                Path(folder) / "distances.dat",
+                dtype=np.float64,
+                mode="w+",
+                shape=expected.shape
+            )
+            pairwise_distances(data, tile_size=16, out=out)
+            np.testing.assert_array_equal(out, expected)
+            del out
+
+        with self.assertRaises(ValueError):
+            pairwise_distances(data, metric="cosine")
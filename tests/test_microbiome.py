@@ -0,0 +1,697 @@
+from io import StringIO
+import json
+import os
+from pathlib import Path
+import tempfile
+from living_figures.bio.fom.widgets.microbiome import MicrobiomeExplorer
+from living_figures.bio.fom.widgets.microbiome import batch
+from living_figures.bio.fom.widgets.microbiome.base_plots import MicrobiomePlot
+from living_figures.bio.fom.widgets.microbiome.base_widget import warmed_up
+from living_figures.bio.fom.widgets.microbiome.ordination import Ordination
+from living_figures.bio.fom.utilities import log_proportions, streaming_pca
+from living_figures.helpers.distances import pairwise_distances
+from living_figures.helpers.registry import shared_datasets
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+import unittest
+from unittest.mock import patch
+
+
+def make_abund(n_samples=30, seed=0) -> StringIO:
+    """Make a MetaPhlAn-style table of organism abundances."""
+
+    rng = np.random.default_rng(seed)
+
+    paths = [
+        f"k__Bacteria|p__P{p}|c__C{p}|o__O{p}|f__F{p}|g__G{p}{g}|s__S{p}{g}{s}"
+        for p in range(3)
+        for g in range(4)
+        for s in range(3)
+    ]
+    df = pd.DataFrame(
+        rng.integers(0, 1000, size=(len(paths), n_samples)),
+        index=paths,
+        columns=[f"sample{i}" for i in range(n_samples)]
+    )
+
+    # Add the summed abundances of each higher rank
+    for n_ranks in range(1, 7):
+        df = pd.concat([
+            df,
+            df.loc[
+                [path.count("|") == 6 for path in df.index.values]
+            ].groupby(
+                lambda path: "|".join(path.split("|")[:n_ranks])
+            ).sum()
+        ])
+
+    handle = StringIO(df.to_csv())
+    handle.name = "abund.csv"
+    return handle
+
+
+def make_explorer(**kwargs) -> MicrobiomeExplorer:
+    """Set up a MicrobiomeExplorer with a test dataset."""
+
+    explorer = MicrobiomeExplorer(**kwargs)
+    explorer._get_child("data", "abund").parse_files(make_abund())
+    return explorer
+
+
+class TestPrecision(unittest.TestCase):
+    """Results computed in float32 must match those in float64."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.f64 = make_explorer()
+        cls.f32 = make_explorer(precision="float32")
+
+    def plot(self, explorer, plot_type):
+        for plot_elem in explorer.find_plots():
+            if plot_elem.id == plot_type:
+                return plot_elem
+
+    def test_abund(self):
+
+        abund64 = self.f64.abund(level="genus")
+        abund32 = self.f32.abund(level="genus")
+
+        self.assertTrue((abund32.dtypes == np.float32).all())
+        self.assertTrue((abund64.dtypes == np.float64).all())
+        np.testing.assert_allclose(abund32, abund64, rtol=1e-5)
+
+    def test_distances(self):
+
+        for metric in ["braycurtis", "euclidean", "jensenshannon"]:
+            dm = [
+                explorer.distances("species", "None", metric)
+                for explorer in [self.f64, self.f32]
+            ]
+            self.assertEqual(dm[1].values.dtype, np.float32)
+            np.testing.assert_allclose(
+                dm[1].values,
+                dm[0].values,
+                rtol=1e-4,
+                atol=1e-6
+            )
+
+    def test_pca(self):
+
+        proj = [
+            self.plot(explorer, "ordination").run_pca(
+                explorer.abund(level="species")
+            )[0]
+            for explorer in [self.f64, self.f32]
+        ]
+
+        # The sign of each component is arbitrary
+        for i in range(3):
+            np.testing.assert_allclose(
+                np.abs(proj[1].iloc[:, i]),
+                np.abs(proj[0].iloc[:, i]),
+                rtol=1e-3,
+                atol=1e-3
+            )
+
+    def test_alpha_diversity(self):
+
+        alpha = [
+            self.plot(explorer, "alpha_diversity")
+            for explorer in [self.f64, self.f32]
+        ]
+        abund = [
+            explorer.abund(level="species")
+            for explorer in [self.f64, self.f32]
+        ]
+
+        for method in ["calc_shannon", "calc_simpson"]:
+            np.testing.assert_allclose(
+                getattr(alpha[1], method)(abund[1]),
+                getattr(alpha[0], method)(abund[0]),
+                rtol=1e-5
+            )
+
+
+class TestBatch(unittest.TestCase):
+    """Figures rendered in batch must be written for every dataset."""
+
+    def run_batch(self, workers):
+
+        with tempfile.TemporaryDirectory() as folder:
+
+            abund = make_abund()
+            with open(Path(folder) / "abund.csv", "w") as handle:
+                handle.write(abund.getvalue())
+
+            config = dict(
+                datasets=[dict(name="test", abund="abund.csv")],
+                figures=[
+                    dict(
+                        name="pca",
+                        plot="ordination",
+                        params=dict(tax_level="genus")
+                    ),
+                    dict(name="heatmap", plot="abundant_orgs"),
+                    dict(name="missing", plot="not_a_plot")
+                ],
+                formats=["html", "json"],
+                output="figures"
+            )
+            config_fp = Path(folder) / "batch.json"
+            with open(config_fp, "w") as handle:
+                json.dump(config, handle)
+
+            results = batch.run_batch(
+                batch.load_config(config_fp),
+                workers=workers
+            )
+
+            self.assertEqual(len(results), 3)
+            for result in results[:2]:
+                self.assertEqual(result["errors"], [])
+                self.assertEqual(len(result["files"]), 2)
+                for fp in result["files"]:
+                    self.assertTrue(os.path.exists(fp))
+            self.assertEqual(len(results[2]["errors"]), 1)
+
+    def test_config(self):
+
+        with tempfile.TemporaryDirectory() as folder:
+
+            config_fp = Path(folder) / "batch.json"
+            figures = [dict(name="pca", plot="ordination")]
+            for fn in ["a.csv", os.path.join("b", "a.csv")]:
+                os.makedirs(Path(folder, fn).parent, exist_ok=True)
+                Path(folder, fn).write_text(make_abund().getvalue())
+
+            # Invalid configurations are reported before any work is done
+            for datasets, msg in [
+                ([dict(name="test")], "Entry 1 of datasets"),
+                ([dict(abund="missing.csv")], "File not found"),
+                (
+                    [dict(abund="a.csv"), dict(abund="b/a.csv")],
+                    "Duplicate name in datasets: a"
+                ),
+            ]:
+                with open(config_fp, "w") as handle:
+                    json.dump(dict(datasets=datasets, figures=figures), handle)
+                with self.assertRaisesRegex(ValueError, msg):
+                    batch.load_config(config_fp)
+
+    def test_serial(self):
+        self.run_batch(1)
+
+    def test_parallel(self):
+        self.run_batch(2)
+
+
+class TestVisiblePlots(unittest.TestCase):
+    """Only the plots which are displayed on the page are updated."""
+
+    def test_update_options(self):
+
+        explorer = make_explorer()
+        plots = list(explorer.find_plots())
+
+        # Plots are only displayed if they have a container on the page
+        self.assertEqual(explorer.visible_plots(), [])
+        ordination = plots[1]
+        single_organism = plots[5]
+        for plot in [ordination, single_organism]:
+            plot.main_container = object()
+        self.assertEqual(
+            explorer.visible_plots(),
+            [ordination, single_organism]
+        )
+        self.assertEqual(
+            explorer.visible_plots("single_organism"),
+            [single_organism]
+        )
+
+        with patch.object(
+            MicrobiomePlot,
+            "update_options",
+            autospec=True
+        ) as update_options:
+            explorer.update_options()
+
+        updated = [
+            (call.args[0].id, call.args[2])
+            for call in update_options.call_args_list
+        ]
+        self.assertEqual(updated, [
+            ("ordination", "color_by"),
+            ("ordination", "filter_by"),
+            ("single_organism", "color_by"),
+            ("single_organism", "filter_by"),
+            ("single_organism", "org")
+        ])
+        self.assertTrue(all(
+            call.args[0] in [ordination, single_organism]
+            for call in update_options.call_args_list
+        ))
+
+
+class TestWarmUp(unittest.TestCase):
+    """Default plots are precomputed once for each set of inputs."""
+
+    def test_warm_up(self):
+
+        self.assertIsNone(make_explorer().warm_up())
+
+        explorer = make_explorer(warm_cache=True)
+        warmed_up.discard((explorer.abund_hash(), None))
+        thread = explorer.warm_up()
+        self.assertIsNotNone(thread)
+        thread.join()
+
+        # The default ordination was computed in the background
+        key = ("abund", explorer.abund_hash(), None, "class", "None")
+        self.assertIn(key, shared_datasets)
+
+        # Later runs with the same inputs do not start another thread,
+        # even once the data registry has been cleared
+        self.assertIsNone(explorer.warm_up())
+        shared_datasets.clear()
+        self.assertIsNone(make_explorer(warm_cache=True).warm_up())
+
+
+class TestRenderMode(unittest.TestCase):
+    """Large scatter plots are drawn with WebGL unless SVG is selected."""
+
+    def test_threshold(self):
+
+        plot = make_explorer().default_plot("ordination")
+        self.assertEqual(plot.render_mode(1000), "svg")
+        self.assertEqual(plot.render_mode(1001), "webgl")
+        self.assertEqual(plot.render_mode(1001, "SVG"), "svg")
+        self.assertEqual(plot.render_mode(10, "WebGL"), "webgl")
+
+    def test_ordination(self):
+
+        explorer = MicrobiomeExplorer()
+        explorer._get_child("data", "abund").parse_files(
+            make_abund(n_samples=1200)
+        )
+        plot = explorer.default_plot("ordination")
+        self.assertEqual(plot.compute()["fig"].data[0].type, "scattergl")
+
+        plot.option("render_mode").set_value("SVG")
+        self.assertEqual(plot.compute()["fig"].data[0].type, "scatter")
+
+
+class TestHoverTemplates(unittest.TestCase):
+    """Figures send numeric arrays, with the labels formatted by plotly."""
+
+    def test_abundant_orgs(self):
+
+        plot = make_explorer().default_plot("abundant_orgs")
+        abund = pd.DataFrame(
+            [[1.5, 2.25], [3., 4.]],
+            index=["org1", "org2"],
+            columns=["sample1", "sample2"]
+        )
+
+        heatmap = plot.plot_heatmap(abund, "Blues")[0]
+        self.assertEqual(heatmap.z.dtype, np.float32)
+        self.assertIsNone(heatmap.text)
+        self.assertIn("%{z:.4g}", heatmap.hovertemplate)
+
+        bars = plot.plot_bars(abund)
+        self.assertEqual([bar.name for bar in bars], ["org1", "org2"])
+        self.assertEqual(bars[0].y.dtype, np.float32)
+        self.assertIn("%{fullData.name}", bars[0].hovertemplate)
+
+        # Annotations are labeled with their original values
+        annots = pd.DataFrame(
+            dict(group=["A", "B"], age=[30, None]),
+            index=["sample1", "sample2"]
+        )
+        heatmap = plot.plot_annot(annots, "Viridis")
+        self.assertEqual(heatmap.customdata.shape, heatmap.z.shape)
+        self.assertEqual(
+            heatmap.customdata.tolist(),
+            [["A", "B"], ["30.0", ""]]
+        )
+        np.testing.assert_array_equal(heatmap.z[0], [0, 1])
+        self.assertIn("%{customdata}", heatmap.hovertemplate)
+
+
+class TestTaxonomyTree(unittest.TestCase):
+    """The nodes shown in the tree must form a consistent hierarchy."""
+
+    def test_prune_nodes(self):
+
+        explorer = make_explorer()
+        nodes = explorer.taxonomy_nodes()
+        tree = explorer.default_plot("taxonomy_tree")
+
+        # Every sample is fully accounted for by the top-level nodes
+        self.assertAlmostEqual(
+            nodes.query("depth == 1")["mean"].sum(),
+            100
+        )
+
+        pruned = tree.prune_nodes(nodes, max_depth=3, min_abund=5)
+        self.assertLess(pruned.shape[0], nodes.shape[0])
+        self.assertLessEqual(pruned["depth"].max(), 3)
+        self.assertTrue((pruned["mean"] >= 5).all())
+
+        # The parent of every node is also shown
+        ids = set(pruned["id"].values) | {""}
+        self.assertTrue(pruned["parent"].isin(ids).all())
+
+        fig = tree.compute()["fig"]
+        self.assertEqual(len(fig.data), 1)
+
+        # Negative minimum abundances cannot be entered
+        self.assertEqual(tree.option("min_abund").min_value, 0.)
+
+
+class TestSampleSummary(unittest.TestCase):
+    """The summary of each sample must match the abundance table."""
+
+    def test_summary(self):
+
+        explorer = make_explorer()
+        summary = explorer.sample_summary()
+        abund = explorer.abund(level="species")
+
+        self.assertEqual(summary.shape[0], 30)
+        np.testing.assert_array_equal(
+            summary["richness_species"].reindex(index=abund.columns),
+            (abund > 0).sum()
+        )
+        np.testing.assert_array_equal(
+            summary["top_taxon"].reindex(index=abund.columns),
+            abund.idxmax()
+        )
+        np.testing.assert_allclose(
+            summary["top_share"].reindex(index=abund.columns),
+            abund.max()
+        )
+
+
+class TestCompositional(unittest.TestCase):
+    """Log-ratio transforms must be computed once for each set of samples."""
+
+    def test_transforms(self):
+
+        explorer = make_explorer()
+        abund = explorer.abund(level="species")
+
+        # Zeros are replaced, and each sample still sums to 1
+        abund = abund.where(abund > 2, 0.)
+        log_props = log_proportions(abund)
+        self.assertTrue(np.isfinite(log_props.values).all())
+        np.testing.assert_allclose(np.exp(log_props).sum(), 1.)
+        detected = abund > 0
+        ratios = np.exp(log_props[detected]) / (abund / abund.sum())
+        np.testing.assert_allclose(ratios.max(), ratios.min())
+
+        # Sparse tables give the same result
+        np.testing.assert_allclose(
+            log_proportions(abund.astype(pd.SparseDtype(float, 0))),
+            log_props
+        )
+
+        # The CLR of each sample is centered, and the ALR drops the reference
+        clr = explorer.transformed("species", "None", "CLR")
+        np.testing.assert_allclose(clr.sum(), 0., atol=1e-9)
+        alr = explorer.transformed("species", "None", "ALR")
+        self.assertEqual(alr.shape[0], clr.shape[0] - 1)
+        self.assertIs(clr, explorer.transformed("species", None, "CLR"))
+
+        # The Aitchison distance is the Euclidean distance between CLRs
+        dm = explorer.distances("species", "None", "Aitchison").square()
+        np.testing.assert_allclose(
+            dm.values[0, 1],
+            np.linalg.norm(clr.iloc[:, 0] - clr.iloc[:, 1])
+        )
+
+
+class TestBetaDiversity(unittest.TestCase):
+    """Each pair of samples must be labeled by its metadata."""
+
+    def test_pair_labels(self):
+
+        explorer = make_explorer()
+        beta = explorer.default_plot("beta_diversity")
+        dists = explorer.distances("species", "None", "braycurtis")
+        dm = dists.square()
+
+        # Distances are stored once for each pair of samples
+        n_samples = dm.shape[0]
+        first, second = dists.pairs()
+        n_pairs = n_samples * (n_samples - 1) / 2
+        self.assertEqual(dists.values.shape[0], n_pairs)
+        np.testing.assert_array_equal(dm.values[first, second], dists.values)
+
+        # Subsets of samples are selected by position
+        subset = dists.subset(dm.index.values[::-3])
+        np.testing.assert_array_equal(
+            subset.square(),
+            dm.loc[subset.samples, subset.samples]
+        )
+
+        meta = pd.Series(
+            [["B", "A", "C"][i % 3] for i in range(n_samples)],
+            index=dm.index
+        )
+        labels = beta.label_meta(dists, meta)
+        for ix, label in enumerate(labels):
+            vals = sorted([meta.iloc[first[ix]], meta.iloc[second[ix]]])
+            if vals[0] == vals[1]:
+                self.assertEqual(label, f"Within {vals[0]}")
+            else:
+                self.assertEqual(label, f"{vals[0]} vs. {vals[1]}")
+
+    def test_distance_workers(self):
+
+        explorer = MicrobiomeExplorer(max_workers=3)
+        explorer._get_child("data", "abund").parse_files(make_abund(seed=2))
+
+        # Distances are computed with the workers of the explorer
+        with patch(
+            "living_figures.bio.fom.widgets.microbiome.base_widget"
+            ".pairwise_distances",
+            wraps=pairwise_distances
+        ) as compute:
+            explorer.distances("species", "None", "braycurtis")
+        self.assertEqual(compute.call_args.kwargs["max_workers"], 3)
+
+
+class TestOrdination(unittest.TestCase):
+    """Ordinations must match those computed with every component."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.explorer = make_explorer()
+        cls.ordination = cls.explorer.default_plot("ordination")
+
+    def test_truncated_pca(self):
+
+        abund = self.explorer.abund(level="species")
+        full = PCA().fit(abund.T)
+
+        for table in [abund, abund.astype(pd.SparseDtype(float, 0))]:
+            coords, loadings = self.ordination.run_pca(table)
+            self.assertEqual(coords.shape, (30, 3))
+            np.testing.assert_allclose(
+                np.abs(coords.values),
+                np.abs(full.transform(abund.T)[:, :3]),
+                rtol=1e-4,
+                atol=1e-6
+            )
+            np.testing.assert_allclose(
+                np.abs(loadings.values),
+                np.abs(full.components_[:3]),
+                rtol=1e-4,
+                atol=1e-6
+            )
+
+    def test_streaming_pca(self):
+
+        abund = self.explorer.abund(level="species")
+        in_memory = self.ordination.run_pca(abund)
+
+        # Samples are read in batches from the table, or from disk
+        for batch_size in [7, 30]:
+            streamed = self.ordination.run_pca(abund, batch_size=batch_size)
+            for ix in range(2):
+                np.testing.assert_allclose(
+                    np.abs(streamed[ix].values),
+                    np.abs(in_memory[ix].values),
+                    rtol=1e-6,
+                    atol=1e-8
+                )
+
+        with tempfile.TemporaryDirectory() as folder:
+            mmap = np.memmap(
+                Path(folder) / "abund.dat",
+                dtype=np.float64,
+                mode="w+",
+                shape=abund.T.shape
+            )
+            mmap[:] = abund.T.values
+            coords, components, _ = streaming_pca(mmap, batch_size=7)
+            np.testing.assert_allclose(
+                np.abs(coords),
+                np.abs(in_memory[0].values),
+                rtol=1e-6,
+                atol=1e-8
+            )
+            del mmap
+
+        # Without the covariance matrix, if there are too many features
+        coords, components, ratios = streaming_pca(
+            abund,
+            batch_size=7,
+            max_features=10
+        )
+        np.testing.assert_allclose(
+            np.abs(coords),
+            np.abs(in_memory[0].values),
+            rtol=1e-5,
+            atol=1e-6
+        )
+        np.testing.assert_allclose(
+            np.abs(components),
+            np.abs(in_memory[1].values),
+            rtol=1e-5,
+            atol=1e-6
+        )
+        np.testing.assert_allclose(
+            ratios,
+            PCA(n_components=3).fit(abund.T).explained_variance_ratio_
+        )
+
+    def test_tsne(self):
+
+        pcs = self.ordination.pca("species", "None", n_components=50)[0]
+
+        # Results are the same each time
+        coords = [
+            self.ordination.run_tsne(pcs, is_3d=False, perplexity=10.)
+            for _ in range(2)
+        ]
+        self.assertEqual(coords[0].shape, (30, 2))
+        np.testing.assert_allclose(coords[0], coords[1])
+
+        # Each value of a perplexity sweep is labeled
+        sweep = self.ordination.tsne_sweep("species", "None", False, "5, 10")
+        self.assertEqual(sweep.shape, (60, 3))
+        self.assertEqual(sorted(sweep["perplexity"].unique()), [5., 10.])
+
+    def test_tsne_threads(self):
+
+        explorer = make_explorer(max_workers=4)
+        ordination = explorer.default_plot("ordination")
+
+        # The workers of the explorer are divided between the values
+        with patch(
+            "living_figures.bio.fom.widgets.microbiome.ordination.TSNE",
+            wraps=TSNE
+        ) as tsne:
+            ordination.tsne_sweep("species", "None", False, "6, 7")
+        self.assertEqual(
+            [call.kwargs["n_jobs"] for call in tsne.call_args_list],
+            [2, 2]
+        )
+
+    def test_pcoa(self):
+
+        # Euclidean PCoA is equivalent to PCA
+        dm = self.explorer.distances("species", "None", "euclidean")
+        abund = self.explorer.abund(level="species")
+        coords = self.ordination.run_pcoa(dm.square())
+        np.testing.assert_allclose(
+            np.abs(coords.values),
+            np.abs(PCA(n_components=3).fit_transform(
+                (abund / abund.sum()).T
+            )),
+            rtol=1e-4,
+            atol=1e-6
+        )
+
+        # The distance matrix is shared with the Beta Diversity plot
+        self.assertIs(
+            self.explorer.distances("species", "None", "Bray-Curtis"),
+            self.explorer.distances("species", "None", "braycurtis")
+        )
+
+    def test_nmds(self):
+
+        dm = self.explorer.distances("species", "None", "braycurtis").square()
+
+        # The best of several starts is no worse than any single start
+        coords, stress = self.ordination.run_nmds(dm, False, n_starts=3)
+        single = self.ordination.run_nmds(dm, False, n_starts=1)[1]
+        self.assertEqual(coords.shape, (30, 2))
+        self.assertLessEqual(stress, single)
+
+        # Results are the same each time
+        np.testing.assert_allclose(
+            coords,
+            self.ordination.run_nmds(dm, False, n_starts=3)[0]
+        )
+
+    def test_filtered_ordination(self):
+
+        explorer = make_explorer()
+        annots = StringIO("sample,group\n" + "\n".join(
+            f"sample{i},{'AB'[i % 2]}" for i in range(30)
+        ))
+        annots.name = "annots.csv"
+        explorer._get_child("data", "annots").parse_files(annots)
+        ordination = explorer.default_plot("ordination")
+
+        filter_by = "group == 'A'"
+        abund = explorer.abund(level="species", filter=filter_by)
+        self.assertEqual(abund.shape[1], 15)
+
+        # Filtered samples are shown on the axes fit to all samples
+        coords = ordination.run_ordination(
+            "species", filter_by, "PCA", abund, False
+        )[0]
+        all_coords = ordination.pca("species", "None")[0]
+        self.assertEqual(coords.shape, (15, 3))
+        np.testing.assert_allclose(coords, all_coords.loc[abund.columns])
+
+        # Unless the ordination is refit to those samples
+        refit = ordination.run_ordination(
+            "species", filter_by, "PCA", abund, False, refit=True
+        )[0]
+        np.testing.assert_allclose(
+            refit,
+            ordination.pca("species", filter_by)[0]
+        )
+
+    def test_shared_pca(self):
+
+        explorer = MicrobiomeExplorer()
+        explorer._get_child("data", "abund").parse_files(make_abund(seed=1))
+        ordination = explorer.default_plot("ordination")
+
+        with patch.object(
+            Ordination,
+            "run_pca",
+            autospec=True,
+            side_effect=Ordination.run_pca
+        ) as run_pca:
+            fig_2d = ordination.compute()["fig"]
+            ordination.option("3D").set_value(True)
+            fig_3d = ordination.compute()["fig"]
+
+        # The 2D and 3D plots use the same fit
+        self.assertEqual(run_pca.call_count, 1)
+        self.assertEqual(fig_2d.data[0].type, "scatter")
+        self.assertEqual(fig_3d.data[0].type, "scatter3d")
+        np.testing.assert_array_equal(fig_2d.data[0].x, fig_3d.data[0].x)
+        np.testing.assert_array_equal(fig_2d.data[0].y, fig_3d.data[0].y)
+        self.assertEqual(
+            fig_2d.layout.xaxis.title.text,
+            fig_3d.layout.scene.xaxis.title.text
+        )